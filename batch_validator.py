@@ -0,0 +1,169 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+import elf
+import validator
+
+# Validates many files in a pool of worker processes, using the Python
+# validator in validator.py.  Unlike dfa_ncval, this does not stop at
+# the first file that fails: it writes one JSON object per file, one
+# per line, so that the output can be streamed and grepped, e.g.
+#
+#   {"errors": [], "file": "foo.nexe", "seconds": 0.012, "status": "valid"}
+#
+# "status" is "valid", "invalid" (the validator rejected the file), or
+# "error" (the file could not be read or is not a well-formed ELF
+# file).
+
+
+def IsElfFile(filename):
+  fh = open(filename, 'rb')
+  try:
+    return fh.read(len(elf.magic)) == elf.magic
+  finally:
+    fh.close()
+
+
+# Returns the JSON object for one file, or None if "elf_only" is true
+# and the file is not an ELF file.  This runs in a worker process, so
+# that a file that cannot be read is reported without stopping the
+# other files.  Any exception is caught and reported as an error for
+# the file, since letting it escape would abort the whole batch.
+def ValidateOne((filename, elf_only)):
+  start_time = time.time()
+  try:
+    if elf_only and not IsElfFile(filename):
+      return None
+    errors = validator.ValidateFile(validator.worker_dfa, filename)
+  except Exception, error:
+    status = 'error'
+    errors = [str(error) or error.__class__.__name__]
+  else:
+    if len(errors) == 0:
+      status = 'valid'
+    else:
+      status = 'invalid'
+  return {'file': filename,
+          'status': status,
+          'errors': errors,
+          'seconds': round(time.time() - start_time, 6)}
+
+
+# Yields (filename, elf_only) for the files to validate.  Directories
+# are searched recursively, and only the ELF files in them are
+# validated; other files named on the command line are always
+# validated, so that a non-ELF file is reported rather than skipped.
+# The files are not opened here, so that an unreadable file is
+# reported by ValidateOne() rather than stopping the search.
+def FindFiles(paths):
+  for path in paths:
+    if not os.path.isdir(path):
+      yield path, False
+      continue
+    for dir_path, dir_names, file_names in os.walk(path):
+      dir_names.sort()
+      for file_name in sorted(file_names):
+        filename = os.path.join(dir_path, file_name)
+        if os.path.isfile(filename):
+          yield filename, True
+
+
+# A manifest lists one path per line.  Blank lines and lines starting
+# with '#' are ignored.  A manifest of '-' is read from stdin.
+def ReadManifest(manifest):
+  if manifest == '-':
+    fh = sys.stdin
+  else:
+    fh = open(manifest, 'r')
+  try:
+    for line in fh:
+      line = line.strip()
+      if line != '' and not line.startswith('#'):
+        yield line
+  finally:
+    if fh is not sys.stdin:
+      fh.close()
+
+
+def GetPaths(args, manifests):
+  for manifest in manifests:
+    for path in ReadManifest(manifest):
+      yield path
+  for path in args:
+    yield path
+
+
+def Main(args):
+  parser = optparse.OptionParser(
+      usage='%prog [options] [file or directory...]')
+  parser.add_option('--trie', dest='trie_file', default='x86_32.trie',
+                    help='DFA file to validate with (default: %default)')
+  parser.add_option('--byte-classes', dest='use_byte_classes',
+                    action='store_true', default=False,
+                    help='Index the transition table by byte class')
+  parser.add_option('--manifest', dest='manifests', action='append',
+                    default=[],
+                    help='File listing paths to validate, one per line '
+                    '("-" for stdin).  May be given more than once')
+  parser.add_option('-o', '--output', dest='output', default='-',
+                    help='File to write JSON results to (default: stdout)')
+  parser.add_option('-j', '--jobs', dest='jobs', type='int',
+                    default=multiprocessing.cpu_count(),
+                    help='Number of worker processes (default: %default)')
+  options, args = parser.parse_args(args)
+  assert options.jobs >= 1, options.jobs
+
+  tasks = FindFiles(GetPaths(args, options.manifests))
+  if options.output == '-':
+    out = sys.stdout
+  else:
+    out = open(options.output, 'w')
+
+  counts = {'valid': 0, 'invalid': 0, 'error': 0}
+  start_time = time.time()
+  init_args = (options.trie_file, options.use_byte_classes)
+  # Each worker loads the DFA once.  Binary trie files are
+  # memory-mapped, so the workers share the DFA's pages.
+  if options.jobs == 1:
+    validator.InitWorker(*init_args)
+    pool = None
+    results = (ValidateOne(task) for task in tasks)
+  else:
+    pool = multiprocessing.Pool(options.jobs, validator.InitWorker,
+                                init_args)
+    # Results are written in the order that they finish in.  Sending
+    # the filenames in small batches keeps the workers busy without
+    # letting one worker queue up many large files.
+    results = pool.imap_unordered(ValidateOne, tasks, chunksize=4)
+  try:
+    for result in results:
+      if result is None:
+        continue
+      counts[result['status']] += 1
+      out.write(json.dumps(result, sort_keys=True) + '\n')
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    if out is not sys.stdout:
+      out.close()
+
+  sys.stderr.write('%i files: %i valid, %i invalid, %i errors (%.2fs)\n'
+                   % (sum(counts.itervalues()), counts['valid'],
+                      counts['invalid'], counts['error'],
+                      time.time() - start_time))
+  if counts['invalid'] > 0 or counts['error'] > 0:
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,85 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch_validator
+import elf
+
+
+def WriteFile(filename, data):
+  fh = open(filename, 'wb')
+  try:
+    fh.write(data)
+  finally:
+    fh.close()
+
+
+class BatchValidatorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp(prefix='batch_validator_test.')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def Path(self, name):
+    return os.path.join(self.temp_dir, name)
+
+  # Runs batch_validator.py and returns its exit code and a map from
+  # file name to status.
+  def Run(self, args):
+    output = self.Path('results.json')
+    rc = batch_validator.Main(['-o', output] + args)
+    fh = open(output, 'r')
+    try:
+      results = [json.loads(line) for line in fh]
+    finally:
+      fh.close()
+    return rc, dict((os.path.basename(result['file']), result['status'])
+                    for result in results)
+
+  def MakeFiles(self, dir_path):
+    # 'int $0x80' is not allowed.
+    WriteFile(os.path.join(dir_path, 'valid.o'),
+              elf.MakeElfFile('\x90' * 32, 0x20000))
+    WriteFile(os.path.join(dir_path, 'invalid.o'),
+              elf.MakeElfFile('\xcd\x80' + '\x90' * 30, 0x20000))
+    WriteFile(os.path.join(dir_path, 'not_elf.txt'), 'hello\n')
+    # A file that cannot be opened.
+    os.symlink(os.path.join(dir_path, 'missing'),
+               os.path.join(dir_path, 'unreadable.o'))
+
+  def test_files(self):
+    self.MakeFiles(self.temp_dir)
+    paths = [self.Path(name) for name in
+             ('valid.o', 'invalid.o', 'not_elf.txt', 'unreadable.o')]
+    expected = {'valid.o': 'valid', 'invalid.o': 'invalid',
+                'not_elf.txt': 'error', 'unreadable.o': 'error'}
+    for jobs in ('1', '2'):
+      self.assertEquals(self.Run(['-j', jobs] + paths), (1, expected))
+
+  def test_directory(self):
+    dir_path = self.Path('dir')
+    os.mkdir(dir_path)
+    self.MakeFiles(dir_path)
+    # A file without read permission, which root can still read.
+    locked = os.path.join(dir_path, 'locked.o')
+    WriteFile(locked, elf.MakeElfFile('\x90' * 32, 0x20000))
+    os.chmod(locked, 0)
+    # Non-ELF files are skipped when searching a directory.
+    expected = {'valid.o': 'valid', 'invalid.o': 'invalid',
+                'locked.o': 'valid'}
+    if not os.access(locked, os.R_OK):
+      expected['locked.o'] = 'error'
+    for jobs in ('1', '2'):
+      self.assertEquals(self.Run(['-j', jobs, dir_path]), (1, expected))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,324 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import multiprocessing
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import batch_validator
+import elf
+from memoize import Memoize
+import trie
+import trie_ops
+import trie_sample
+import trie_stages
+import validator
+
+# Measures the throughput of the validators on a corpus of files.
+#
+# The corpus is made of synthetic ELF32 files, which are generated
+# from the DFA with a fixed random seed so that runs are comparable,
+# plus any real files (e.g. nexes) named on the command line.  Each
+# synthetic file is filled with a mix of:
+#
+#  * templates: instructions sampled uniformly from those the DFA
+#    accepts, with random values for their wildcard bytes;
+#  * jumps: direct jumps, whose targets are the following
+#    instruction;
+#  * superinsts: the sandboxed indirect jumps from
+#    trie_stages.SandboxedJumps(), which exercise the superinst_start
+#    backtracking.
+#
+# Instructions are padded with nops so that none crosses a bundle
+# boundary, so every synthetic file is valid.
+#
+# Each backend validates each file "repeats" times, and we report its
+# throughput over the code sections and the percentiles of the time
+# taken per file.  The dfa_ncval backend includes the cost of starting
+# a process for each file.
+
+
+load_addr = 0x20000
+nop = '90'
+
+default_mix = 'templates:8,jumps:1,superinsts:1'
+jump_accept_types = ('jump_rel1', 'jump_rel2', 'jump_rel4')
+
+
+def ParseMix(mix):
+  weights = []
+  for item in mix.split(','):
+    kind, weight = item.split(':')
+    if kind not in instruction_sources:
+      raise Exception('Unknown instruction kind %r in mix: expected one of %s'
+                      % (kind, ', '.join(sorted(instruction_sources))))
+    weights.append((kind, int(weight)))
+  return weights
+
+
+# Returns a trie of the instructions in "node" whose accept type is in
+# "accept_types".
+@Memoize
+def FilterAcceptTypes(node, accept_types):
+  if node.accept in accept_types:
+    accept = node.accept
+  else:
+    accept = False
+  return trie_ops.MakeNode(
+      dict((key, FilterAcceptTypes(child, accept_types))
+           for key, child in node.children.iteritems()),
+      accept)
+
+
+# Returns a list of byte values for an instruction template from the
+# DFA, with wildcards filled in from "rng".  Jump displacements are
+# zero, so that each jump targets the next instruction.
+def FillTemplate(bytes, accept, rng):
+  if accept in jump_accept_types:
+    wildcard = lambda: 0
+  else:
+    wildcard = lambda: rng.randrange(256)
+  return [wildcard() if byte == trie.wildcard_key else int(byte, 16)
+          for byte in bytes]
+
+
+def SampleTemplates(root, rng):
+  index = trie_sample.InstructionIndex(root)
+  while True:
+    bytes, label_map = index.Sample(rng)
+    yield FillTemplate(bytes, trie_ops.AcceptType(root, bytes), rng)
+
+
+def SampleJumps(root, rng):
+  return SampleTemplates(FilterAcceptTypes(root, jump_accept_types), rng)
+
+
+def SampleSuperinsts(root, rng):
+  superinsts = [trie_sample.InstructionIndex(node).Unrank(0)[0]
+                for node in trie_stages.SandboxedJumps()]
+  while True:
+    yield [int(byte, 16) for byte in rng.choice(superinsts)]
+
+
+instruction_sources = {
+  'templates': SampleTemplates,
+  'jumps': SampleJumps,
+  'superinsts': SampleSuperinsts,
+  }
+
+
+# Returns "size" bytes of valid code, rounded up to a whole number of
+# bundles.  The last bundle is all nops, so that jumps at the end of
+# the code still target an instruction inside it.
+def MakeCode(root, size, mix, rng):
+  kinds = []
+  for kind, weight in mix:
+    kinds.extend([kind] * weight)
+  sources = dict((kind, instruction_sources[kind](root, rng))
+                 for kind, weight in mix)
+  nop_byte = int(nop, 16)
+  code_size = max(size + validator.bundle_mask, validator.bundle_size * 2)
+  code_size &= ~validator.bundle_mask
+  code = bytearray()
+  while len(code) < code_size - validator.bundle_size:
+    instr = sources[rng.choice(kinds)].next()
+    space = validator.bundle_size - (len(code) & validator.bundle_mask)
+    if len(instr) > space:
+      code.extend([nop_byte] * space)
+    else:
+      code.extend(instr)
+  code.extend([nop_byte] * (code_size - len(code)))
+  return str(code)
+
+
+def WriteCorpus(root, directory, count, size, mix, seed):
+  rng = random.Random(seed)
+  filenames = []
+  for index in xrange(count):
+    filename = os.path.join(directory, 'synthetic%i.nexe' % index)
+    fh = open(filename, 'wb')
+    fh.write(elf.MakeElfFile(MakeCode(root, size, mix, rng), load_addr))
+    fh.close()
+    filenames.append(filename)
+  return filenames
+
+
+def CodeSize(filename):
+  elf_file = elf.ElfFile(filename)
+  try:
+    return sum(len(section_data)
+               for load_addr, offset, section_data in elf_file.CodeSections())
+  finally:
+    elf_file.Close()
+
+
+# Each backend is a function that validates a file and returns whether
+# it is valid.
+def PythonBackend(trie_file, use_byte_classes):
+  dfa = validator.LoadDfa(trie_file, use_byte_classes)
+  return lambda filename: len(validator.ValidateFile(dfa, filename)) == 0
+
+
+def ParallelBackend(trie_file, pool, shard_size):
+  dfa = validator.LoadDfa(trie_file)
+  return lambda filename: len(validator.ValidateFileParallel(
+      dfa, pool, filename, shard_size)) == 0
+
+
+# Opening os.devnull costs little next to starting the process.
+def NativeBackend(ncval_path):
+  def Validate(filename):
+    devnull = open(os.devnull, 'w')
+    try:
+      return subprocess.call([ncval_path, filename], stdout=devnull) == 0
+    finally:
+      devnull.close()
+  return Validate
+
+
+# Returns the "percent"th percentile of a sorted list, by the
+# nearest-rank method.
+def Percentile(values, percent):
+  rank = max(1, int(-(-len(values) * percent // 100)))
+  return values[rank - 1]
+
+
+def RunBackend(func, filenames, code_sizes, repeats):
+  times = []
+  valid = {}
+  for filename in filenames:
+    for unused in xrange(repeats):
+      start_time = time.time()
+      valid[filename] = func(filename)
+      times.append(time.time() - start_time)
+  total_time = sum(times)
+  total_size = sum(code_sizes[filename] for filename in filenames) * repeats
+  times.sort()
+  return {'seconds': total_time,
+          'mb_per_second': total_size / total_time / (1 << 20),
+          'bundles_per_second':
+              total_size / validator.bundle_size / total_time,
+          'latency_p50': Percentile(times, 50),
+          'latency_p90': Percentile(times, 90),
+          'latency_p99': Percentile(times, 99),
+          'invalid_files': sorted(filename for filename in filenames
+                                  if not valid[filename])}
+
+
+def Main(args):
+  parser = optparse.OptionParser(usage='%prog [options] [file-or-dir...]')
+  parser.add_option('--trie', dest='trie_file', default='x86_32.trie',
+                    help='DFA file to validate with and to generate '
+                    'instructions from (default: %default)')
+  parser.add_option('--count', dest='count', type='int', default=4,
+                    help='Number of synthetic files (default: %default)')
+  parser.add_option('--size', dest='size', type='int', default=1 << 20,
+                    help='Code size in bytes of each synthetic file '
+                    '(default: %default)')
+  parser.add_option('--mix', dest='mix', default=default_mix,
+                    help='Relative weights of the kinds of instruction in '
+                    'the synthetic files (default: %default)')
+  parser.add_option('--seed', dest='seed', type='int', default=1,
+                    help='Random seed for the synthetic files '
+                    '(default: %default)')
+  parser.add_option('--repeats', dest='repeats', type='int', default=3,
+                    help='Number of times to validate each file '
+                    '(default: %default)')
+  parser.add_option('--ncval', dest='ncval', default='./dfa_ncval',
+                    help='dfa_ncval binary to benchmark, if it exists '
+                    '(default: %default)')
+  parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+                    help='Number of processes for the python-parallel '
+                    'backend, which is only run if this is above 1')
+  parser.add_option('--shard-size', dest='shard_size', type='int',
+                    default=256 * 1024,
+                    help='Shard size for the python-parallel backend '
+                    '(default: %default)')
+  parser.add_option('--corpus-dir', dest='corpus_dir', default=None,
+                    help='Write the synthetic files to this directory and '
+                    'keep them, rather than using a temporary directory')
+  parser.add_option('--json', dest='json_file', default=None,
+                    help='Write the results to this file as JSON')
+  options, args = parser.parse_args(args)
+  mix = ParseMix(options.mix)
+
+  if options.corpus_dir is None:
+    corpus_dir = tempfile.mkdtemp(prefix='benchmark.')
+  else:
+    corpus_dir = options.corpus_dir
+    if not os.path.isdir(corpus_dir):
+      os.makedirs(corpus_dir)
+  pool = None
+  try:
+    root = trie.TrieFromFile(options.trie_file, simplify_wildcards=True)
+    synthetic = WriteCorpus(root, corpus_dir, options.count, options.size,
+                            mix, options.seed)
+    filenames = synthetic + list(batch_validator.FindFiles(args))
+    code_sizes = dict((filename, CodeSize(filename))
+                      for filename in filenames)
+
+    backends = [
+        ('python', PythonBackend(options.trie_file, False)),
+        ('python-classes', PythonBackend(options.trie_file, True)),
+        ]
+    if options.jobs > 1:
+      pool = multiprocessing.Pool(options.jobs, validator.InitWorker,
+                                  (options.trie_file, False))
+      backends.append(('python-parallel',
+                       ParallelBackend(options.trie_file, pool,
+                                       options.shard_size)))
+    if os.path.exists(options.ncval):
+      backends.append(('dfa_ncval', NativeBackend(options.ncval)))
+
+    print 'Corpus: %i files, %i bytes of code' % (
+        len(filenames), sum(code_sizes.itervalues()))
+    print '%-16s %10s %12s %10s %10s %10s' % (
+        'backend', 'MB/s', 'bundles/s', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)')
+    results = {}
+    for name, func in backends:
+      result = RunBackend(func, filenames, code_sizes, options.repeats)
+      bad = [filename for filename in result['invalid_files']
+             if filename in synthetic]
+      if len(bad) > 0:
+        raise Exception('%s rejected synthetic files: %s'
+                        % (name, ', '.join(bad)))
+      results[name] = result
+      print '%-16s %10.2f %12.0f %10.2f %10.2f %10.2f' % (
+          name, result['mb_per_second'], result['bundles_per_second'],
+          result['latency_p50'] * 1000, result['latency_p90'] * 1000,
+          result['latency_p99'] * 1000)
+    for name, result in sorted(results.iteritems()):
+      if len(result['invalid_files']) > 0:
+        print '%s rejected: %s' % (name, ', '.join(result['invalid_files']))
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    if options.corpus_dir is None:
+      shutil.rmtree(corpus_dir)
+
+  if options.json_file is not None:
+    fh = open(options.json_file, 'w')
+    json.dump({'corpus': {'files': filenames,
+                          'code_bytes': sum(code_sizes.itervalues()),
+                          'synthetic_size': options.size,
+                          'mix': options.mix,
+                          'seed': options.seed},
+               'repeats': options.repeats,
+               'backends': results},
+              fh, indent=2, sort_keys=True)
+    fh.write('\n')
+    fh.close()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
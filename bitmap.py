@@ -0,0 +1,71 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import binascii
+import re
+
+# Packed bitmaps of offsets into a code section, laid out like the
+# bitmaps in dfa_ncval.c: offset i is bit (i & 7) of byte (i >> 3).
+# Bitmaps are bytearrays, so the bitmaps of consecutive bundle-aligned
+# chunks of a section can be joined by concatenating them.
+#
+# The bulk operations convert whole bitmaps to Python longs, so that
+# they run a machine word at a time in C rather than a bit at a time
+# in Python.
+
+
+def Allocate(size):
+  return bytearray((size + 7) >> 3)
+
+
+def SetBit(bitmap, index):
+  bitmap[index >> 3] |= 1 << (index & 7)
+
+
+def IsBitSet(bitmap, index):
+  return (bitmap[index >> 3] >> (index & 7)) & 1
+
+
+def FromIndexes(size, indexes):
+  bitmap = Allocate(size)
+  for index in indexes:
+    bitmap[index >> 3] |= 1 << (index & 7)
+  return bitmap
+
+
+# The byte order does not matter here, as long as ToLong() and
+# FromLong() agree on it.
+def ToLong(bitmap):
+  if len(bitmap) == 0:
+    return 0
+  return long(binascii.hexlify(bitmap), 16)
+
+
+def FromLong(value, byte_size):
+  assert value >= 0, value
+  if byte_size == 0:
+    return bytearray()
+  return bytearray(binascii.unhexlify('%0*x' % (byte_size * 2, value)))
+
+
+# Returns a bitmap of the bits that are set in bitmap1 but not in
+# bitmap2.
+def AndNot(bitmap1, bitmap2):
+  assert len(bitmap1) == len(bitmap2), (len(bitmap1), len(bitmap2))
+  return FromLong(ToLong(bitmap1) & ~ToLong(bitmap2), len(bitmap1))
+
+
+nonzero_byte = re.compile('[^\x00]')
+
+
+# Yields the indexes of the set bits in increasing order.  Bitmaps are
+# usually sparse, so this only looks at the non-zero bytes, which the
+# regular expression engine finds for us.
+def SetBits(bitmap):
+  for match in nonzero_byte.finditer(str(bitmap)):
+    byte_index = match.start()
+    byte = bitmap[byte_index]
+    for bit in xrange(8):
+      if byte & (1 << bit):
+        yield (byte_index << 3) | bit
@@ -0,0 +1,67 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import random
+import unittest
+
+import bitmap
+
+
+# The size of the bitmaps below, in bits: a few machine words, plus
+# some bits in a final partial byte.
+chunk_size = 200
+
+# Bits at the start and end of the chunk, either side of the word
+# boundaries, and at byte boundaries.
+edge_bits = [0, 7, 8, 31, 32, 63, 64, 65, 127, 128, chunk_size - 1]
+
+
+class BitmapTest(unittest.TestCase):
+
+  def test_set_bits(self):
+    self.assertEquals(list(bitmap.SetBits(bitmap.Allocate(chunk_size))), [])
+    bits = bitmap.FromIndexes(chunk_size, edge_bits)
+    self.assertEquals(len(bits), (chunk_size + 7) >> 3)
+    self.assertEquals(list(bitmap.SetBits(bits)), edge_bits)
+    for index in xrange(chunk_size):
+      self.assertEquals(bitmap.IsBitSet(bits, index), index in edge_bits)
+
+  def test_set_bit(self):
+    bits = bitmap.Allocate(chunk_size)
+    for index in edge_bits:
+      bitmap.SetBit(bits, index)
+    self.assertEquals(bits, bitmap.FromIndexes(chunk_size, edge_bits))
+
+  def test_long_round_trip(self):
+    for indexes in ([], edge_bits, range(chunk_size)):
+      bits = bitmap.FromIndexes(chunk_size, indexes)
+      value = bitmap.ToLong(bits)
+      self.assertEquals(bin(value).count('1'), len(indexes))
+      self.assertEquals(bitmap.FromLong(value, len(bits)), bits)
+    self.assertEquals(bitmap.ToLong(bytearray()), 0)
+    self.assertEquals(bitmap.FromLong(0, 0), bytearray())
+
+  def test_and_not(self):
+    bits1 = bitmap.FromIndexes(chunk_size, edge_bits)
+    bits2 = bitmap.FromIndexes(chunk_size, [7, 63, 64, chunk_size - 1])
+    self.assertEquals(list(bitmap.SetBits(bitmap.AndNot(bits1, bits2))),
+                      [0, 8, 31, 32, 65, 127, 128])
+    self.assertEquals(list(bitmap.SetBits(bitmap.AndNot(bits2, bits1))), [])
+    # The result keeps its size even if its leading bytes are zero.
+    empty = bitmap.AndNot(bits1, bits1)
+    self.assertEquals(empty, bitmap.Allocate(chunk_size))
+    self.assertEquals(bitmap.AndNot(bytearray(), bytearray()), bytearray())
+
+  def test_and_not_random(self):
+    rand = random.Random(0)
+    for unused in xrange(20):
+      set1 = set(rand.sample(xrange(chunk_size), 50))
+      set2 = set(rand.sample(xrange(chunk_size), 50))
+      result = bitmap.AndNot(bitmap.FromIndexes(chunk_size, set1),
+                             bitmap.FromIndexes(chunk_size, set2))
+      self.assertEquals(list(bitmap.SetBits(result)), sorted(set1 - set2))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,112 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import cPickle
+import hashlib
+import os
+
+# An on-disk cache for the outputs of the stages of generator.Main().
+#
+# Each entry is keyed by a hash of everything the stage's output
+# depends on: the source files that the stage runs, the versions of
+# any external tools it runs, and the content digests of the stage's
+# inputs.  We hash whole source files rather than the functions a
+# stage calls, because it is too easy to miss one of their callees.
+
+
+default_cache_dir = '.build_cache'
+
+
+def HashValues(*values):
+  hasher = hashlib.sha1()
+  for value in values:
+    data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    hasher.update('%i:' % len(data))
+    hasher.update(data)
+  return hasher.hexdigest()
+
+
+def HashFiles(filenames):
+  contents = []
+  for filename in filenames:
+    fh = open(filename, 'rb')
+    contents.append(fh.read())
+    fh.close()
+  return HashValues(*contents)
+
+
+# The total size that Prune() trims the cache to by default.
+default_max_size = 64 << 20
+
+
+class BuildCache(object):
+
+  def __init__(self, directory=default_cache_dir, enabled=True):
+    self.directory = directory
+    self.enabled = enabled
+    self.hits = 0
+    self.misses = 0
+    # The keys read or written by this build, which Prune() keeps.
+    self.used = set()
+
+  def _Path(self, key):
+    return os.path.join(self.directory, key)
+
+  def Get(self, key, default=None):
+    if not self.enabled:
+      return default
+    try:
+      fh = open(self._Path(key), 'rb')
+    except IOError:
+      self.misses += 1
+      return default
+    try:
+      value = cPickle.load(fh)
+    finally:
+      fh.close()
+    self.hits += 1
+    self.used.add(key)
+    # Prune() drops the least recently used entries first.
+    os.utime(self._Path(key), None)
+    return value
+
+  def Put(self, key, value):
+    if not self.enabled:
+      return
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    # Write to a temporary file and rename it so that an interrupted
+    # build cannot leave a truncated entry behind.
+    temp_path = '%s.tmp.%i' % (self._Path(key), os.getpid())
+    fh = open(temp_path, 'wb')
+    try:
+      cPickle.dump(value, fh, cPickle.HIGHEST_PROTOCOL)
+    finally:
+      fh.close()
+    os.rename(temp_path, self._Path(key))
+    self.used.add(key)
+
+  # Every edit to the sources adds a new set of entries, so this
+  # removes the least recently used entries, and any temporary files
+  # left by interrupted builds, until the cache is no larger than
+  # "max_size" bytes.  The entries used by this build are always kept.
+  # Returns the number of files removed.
+  def Prune(self, max_size=default_max_size):
+    if not self.enabled or not os.path.isdir(self.directory):
+      return 0
+    entries = []
+    for name in os.listdir(self.directory):
+      stat = os.stat(self._Path(name))
+      entries.append((name not in self.used, -stat.st_mtime, stat.st_size,
+                      name))
+    entries.sort()
+    total_size = 0
+    removed = 0
+    for unused, negative_mtime, size, name in entries:
+      if unused and ('.tmp.' in name or total_size + size > max_size):
+        os.remove(self._Path(name))
+        removed += 1
+      else:
+        total_size += size
+    return removed
@@ -0,0 +1,54 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import build_cache
+
+
+class BuildCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp(prefix='build_cache_test.')
+    self.directory = os.path.join(self.temp_dir, 'cache')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def test_get_and_put(self):
+    cache = build_cache.BuildCache(self.directory)
+    self.assertEquals(cache.Get('key'), None)
+    cache.Put('key', {'value': [1, 2]})
+    self.assertEquals(cache.Get('key'), {'value': [1, 2]})
+    self.assertEquals((cache.hits, cache.misses), (1, 1))
+    # A disabled cache neither reads nor writes entries.
+    cache = build_cache.BuildCache(self.directory, enabled=False)
+    self.assertEquals(cache.Get('key', 'default'), 'default')
+    cache.Put('other', 1)
+    self.assertEquals(os.listdir(self.directory), ['key'])
+
+  def test_prune(self):
+    cache = build_cache.BuildCache(self.directory)
+    for index, key in enumerate(['old', 'newer', 'newest']):
+      cache.Put(key, 'x' * 1000)
+      path = os.path.join(self.directory, key)
+      os.utime(path, (index, index))
+    # Left behind by an interrupted build.
+    cache.Put('old.tmp.1', '')
+    # A later build only uses "old", so it is kept even though it is
+    # the least recently used entry on disk.
+    cache = build_cache.BuildCache(self.directory)
+    self.assertEquals(cache.Get('old'), 'x' * 1000)
+    self.assertEquals(cache.Prune(2500), 2)
+    self.assertEquals(sorted(os.listdir(self.directory)),
+                      ['newest', 'old'])
+    self.assertEquals(cache.Prune(0), 1)
+    self.assertEquals(os.listdir(self.directory), ['old'])
+
+
+if __name__ == '__main__':
+  unittest.main()
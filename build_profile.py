@@ -0,0 +1,131 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import cProfile
+import json
+import os
+import resource
+import time
+
+import memoize
+import trie
+
+# Records metrics for each stage of a pipeline such as generator.Main(),
+# so that build time and memory use can be tracked across changes to
+# the instruction definitions.
+#
+# For each stage, this records the wall and CPU time, the peak RSS so
+# far, the size of trie.py's interned node table, the memoization
+# caches that the stage used, and whatever counts the caller passes to
+# AddCounts(), such as node counts.  The report is written as JSON.
+#
+# The stages of generator.Main() run objdump and the sub-trie builders
+# in child processes, so the CPU time and peak RSS of children that
+# have finished are recorded separately.
+
+
+def GetUsage():
+  self_usage = resource.getrusage(resource.RUSAGE_SELF)
+  child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+  # ru_maxrss is in kilobytes on Linux.
+  return {'cpu_seconds': self_usage.ru_utime + self_usage.ru_stime,
+          'child_cpu_seconds': child_usage.ru_utime + child_usage.ru_stime,
+          'peak_rss_kb': self_usage.ru_maxrss,
+          'child_peak_rss_kb': child_usage.ru_maxrss}
+
+
+def GetMemoCounts():
+  return dict((info, (info.hits, info.misses))
+              for info in memoize.GetStats())
+
+
+# Returns the activity of each memoized function since "before" (as
+# returned by GetMemoCounts()), omitting the functions that were not
+# called.  The caches are usually cleared between stages, so the sizes
+# are those at the end of the stage.
+def GetMemoDeltas(before):
+  deltas = []
+  for info in memoize.GetStats():
+    hits, misses = before.get(info, (0, 0))
+    hits = info.hits - hits
+    misses = info.misses - misses
+    if hits + misses == 0:
+      continue
+    deltas.append({'name': info.name,
+                   'hits': hits,
+                   'misses': misses,
+                   'size': info.Size(),
+                   'peak_size': max(info.peak_size, info.Size())})
+  return deltas
+
+
+class StageProfiler(object):
+
+  # If "profile_dir" is given, each stage is also run under cProfile,
+  # and its statistics are written to a file in that directory, for
+  # reading with the pstats module.
+  def __init__(self, profile_dir=None):
+    self.profile_dir = profile_dir
+    self.stages = []
+    self.current = None
+    self.start_time = time.time()
+
+  # Starts a new stage, ending the current one if there is one.
+  def Start(self, name):
+    self.End()
+    stage = {'name': name}
+    self.current = (stage, time.time(), GetUsage(), GetMemoCounts(),
+                    self._StartProfile())
+    self.stages.append(stage)
+
+  def _StartProfile(self):
+    if self.profile_dir is None:
+      return None
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+  # Ends the current stage, if there is one.
+  def End(self):
+    if self.current is None:
+      return
+    stage, start_time, start_usage, memo_counts, profile = self.current
+    if profile is not None:
+      profile.disable()
+    usage = GetUsage()
+    stage['wall_seconds'] = time.time() - start_time
+    for key in ('cpu_seconds', 'child_cpu_seconds'):
+      stage[key] = usage[key] - start_usage[key]
+    for key in ('peak_rss_kb', 'child_peak_rss_kb'):
+      stage[key] = usage[key]
+    stage['interned_nodes'] = len(trie.interned)
+    stage['memo_caches'] = GetMemoDeltas(memo_counts)
+    if profile is not None:
+      if not os.path.isdir(self.profile_dir):
+        os.makedirs(self.profile_dir)
+      filename = os.path.join(self.profile_dir, '%02i_%s.prof'
+                              % (len(self.stages), stage['name']))
+      profile.dump_stats(filename)
+      stage['profile'] = filename
+    self.current = None
+
+  # Adds values, such as node counts, to the record of the most recent
+  # stage.  Counting after End() keeps the counting out of the stage's
+  # times.
+  def AddCounts(self, **counts):
+    self.stages[-1].update(counts)
+
+  def Report(self):
+    self.End()
+    usage = GetUsage()
+    usage['wall_seconds'] = time.time() - self.start_time
+    return {'stages': self.stages, 'total': usage}
+
+  def WriteReport(self, filename, **extra):
+    report = self.Report()
+    report.update(extra)
+    fh = open(filename, 'w')
+    json.dump(report, fh, indent=2, sort_keys=True)
+    fh.write('\n')
+    fh.close()
@@ -5,18 +5,16 @@
 import sys
 
 import objdump
+import trie
 
 
-def CheckInstr(trie, bytes):
-  node = trie['start']
+def CheckInstr(table, bytes):
+  state = table.start
   for byte in bytes:
-    if 'XX' in trie['map'][node]:
-      node = trie['map'][node]['XX']
-    elif byte in trie['map'][node]:
-      node = trie['map'][node][byte]
-    else:
+    state = table.NextState(state, byte)
+    if state == 0:
       return False
-  return trie['accepts'][node]
+  return table.AcceptType(state)
 
 
 def Format(string):
@@ -28,10 +26,10 @@ def Main(args):
   trie_file = args[0]
   obj_file = args[1]
 
-  trie = eval(open(trie_file, 'r').read(), {})
+  table = trie.LoadTable(trie_file)
 
   for bytes, disasm in objdump.Decode(obj_file):
-    ok = CheckInstr(trie, ['%02x' % ord(byte) for byte in bytes])
+    ok = CheckInstr(table, [ord(byte) for byte in bytes])
     if disasm.startswith('j') or 'call' in disasm:
       ok = 'Jump'
     print ok, disasm, Format(bytes)
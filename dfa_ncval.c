@@ -6,10 +6,14 @@
 
 #include <assert.h>
 #include <elf.h>
+#include <fcntl.h>
 #include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
 
 #include "trie_table.h"
 
@@ -108,7 +112,9 @@ int ValidateChunk(uint32_t load_addr, uint8_t *data, size_t size) {
         state = trie_start;
       }
 
-      if (trie_accepts_normal_inst(state)) {
+      if (!trie_accepts_any(state)) {
+        /* We are in the middle of an instruction. */
+      } else if (trie_accepts_normal_inst(state)) {
         mask |= 1 << (bundle_offset - 1);
         state = trie_start;
       } else if (trie_accepts_jump_rel1(state)) {
@@ -173,46 +179,46 @@ int ValidateChunk(uint32_t load_addr, uint8_t *data, size_t size) {
   return result;
 }
 
-void ReadFile(const char *filename, uint8_t **result, size_t *result_size) {
-  FILE *fp;
-  uint8_t *data;
-  size_t file_size;
-  size_t got;
+/*
+ * Maps the file read-only rather than reading it into a malloc'd copy,
+ * so that validating a large file does not need twice its size in
+ * memory.
+ */
+void MapFile(const char *filename, uint8_t **result, size_t *result_size) {
+  int fd;
+  struct stat st;
+  void *data;
 
-  fp = fopen(filename, "rb");
-  if (fp == NULL) {
+  fd = open(filename, O_RDONLY);
+  if (fd < 0) {
     fprintf(stderr, "Failed to open input file: %s\n", filename);
     exit(1);
   }
-  /* Find the file size. */
-  fseek(fp, 0, SEEK_END);
-  file_size = ftell(fp);
-  data = malloc(file_size);
-  if (data == NULL) {
-    fprintf(stderr, "Unable to create memory image of input file: %s\n",
+  if (fstat(fd, &st) != 0) {
+    fprintf(stderr, "Unable to find the size of input file: %s\n",
             filename);
     exit(1);
   }
-  fseek(fp, 0, SEEK_SET);
-  got = fread(data, 1, file_size, fp);
-  if (got != file_size) {
-    fprintf(stderr, "Unable to read data from input file: %s\n",
+  data = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+  if (data == MAP_FAILED) {
+    fprintf(stderr, "Unable to create memory image of input file: %s\n",
             filename);
     exit(1);
   }
-  fclose(fp);
+  close(fd);
 
   *result = data;
-  *result_size = file_size;
+  *result_size = st.st_size;
 }
 
 int ValidateFile(const char *filename) {
   size_t data_size;
   uint8_t *data;
-  ReadFile(filename, &data, &data_size);
+  MapFile(filename, &data, &data_size);
 
   Elf_Ehdr *header;
   int index;
+  int result = 0;
 
   header = (Elf_Ehdr *) data;
   CheckBounds(data, data_size, header, sizeof(*header));
@@ -226,14 +232,15 @@ int ValidateFile(const char *filename) {
     if ((section->sh_flags & SHF_EXECINSTR) != 0) {
       CheckBounds(data, data_size,
                   data + section->sh_offset, section->sh_size);
-      int rc = ValidateChunk(section->sh_addr,
+      result = ValidateChunk(section->sh_addr,
                              data + section->sh_offset, section->sh_size);
-      if (rc != 0) {
-        return rc;
+      if (result != 0) {
+        break;
       }
     }
   }
-  return 0;
+  munmap(data, data_size);
+  return result;
 }
 
 int main(int argc, char **argv) {
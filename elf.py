@@ -0,0 +1,112 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import mmap
+import os
+import struct
+
+# A reader for the code sections of ELF32 files.  Files are
+# memory-mapped, and sections are returned as buffer objects that
+# refer to the mapping, so reading a section does not copy it.  Like
+# ValidateFile() in dfa_ncval.c, every header and section is checked
+# to lie inside the file before it is used.
+
+
+header_format = '<16sHHIIIIIHHHHHH'
+section_format = '<IIIIIIIIII'
+header_size = struct.calcsize(header_format)
+section_size = struct.calcsize(section_format)
+
+magic = '\x7fELF'
+ELFCLASS32 = 1
+ELFDATA2LSB = 1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHT_PROGBITS = 1
+ET_EXEC = 2
+EM_386 = 3
+EV_CURRENT = 1
+
+
+def CheckBounds(data_size, offset, inside_size):
+  assert 0 <= offset, offset
+  assert offset + inside_size <= data_size, (offset, inside_size, data_size)
+
+
+# Returns a read-only mapping of the file.  mmap cannot map an empty
+# file, so we return an empty string for one instead.
+def MapFile(filename):
+  fh = open(filename, 'rb')
+  try:
+    if os.fstat(fh.fileno()).st_size == 0:
+      return ''
+    return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+  finally:
+    fh.close()
+
+
+# Yields the fields of each section header, as a tuple in the order of
+# Elf32_Shdr.
+def GetSectionHeaders(data):
+  CheckBounds(len(data), 0, header_size)
+  header = struct.unpack_from(header_format, data, 0)
+  e_ident = header[0]
+  assert e_ident.startswith(magic), 'Not an ELF file'
+  assert ord(e_ident[4]) == ELFCLASS32, 'Not an ELF32 file'
+  assert ord(e_ident[5]) == ELFDATA2LSB, 'Not a little-endian ELF file'
+  e_shoff, e_shentsize, e_shnum = header[6], header[11], header[12]
+  if e_shnum > 0:
+    assert e_shentsize >= section_size, e_shentsize
+  for index in xrange(e_shnum):
+    section_offset = e_shoff + e_shentsize * index
+    CheckBounds(len(data), section_offset, section_size)
+    yield struct.unpack_from(section_format, data, section_offset)
+
+
+# Yields (load_addr, file_offset, section_data) for each executable
+# section.  section_data is a buffer that refers to "data" rather than
+# a copy.
+def GetCodeSections(data):
+  for (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size,
+       sh_link, sh_info, sh_addralign, sh_entsize) in GetSectionHeaders(data):
+    if (sh_flags & SHF_EXECINSTR) != 0:
+      CheckBounds(len(data), sh_offset, sh_size)
+      yield sh_addr, sh_offset, buffer(data, sh_offset, sh_size)
+
+
+# Returns the contents of a minimal ELF32 file with a single executable
+# section holding "code", loaded at "load_addr".  This is enough for
+# the validators, which only look at the section headers.
+def MakeElfFile(code, load_addr):
+  code_offset = header_size
+  section_offset = code_offset + len(code)
+  # Section 0 is the null section, as usual.
+  sections = [(0,) * 10,
+              (0, SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, load_addr,
+               code_offset, len(code), 0, 0, 32, 0)]
+  header = struct.pack(
+      header_format,
+      magic + chr(ELFCLASS32) + chr(ELFDATA2LSB) + chr(EV_CURRENT),
+      ET_EXEC, EM_386, EV_CURRENT, load_addr, 0, section_offset, 0,
+      header_size, 0, 0, section_size, len(sections), 0)
+  return ''.join([header, code] +
+                 [struct.pack(section_format, *section)
+                  for section in sections])
+
+
+class ElfFile(object):
+
+  # The buffers returned by CodeSections() refer to the file's mapping,
+  # so they must not be used after Close().
+  def __init__(self, filename):
+    self.filename = filename
+    self.data = MapFile(filename)
+
+  def CodeSections(self):
+    return GetCodeSections(self.data)
+
+  def Close(self):
+    if isinstance(self.data, mmap.mmap):
+      self.data.close()
+    self.data = None
@@ -0,0 +1,127 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import elf
+
+
+code = ''.join(chr(byte) for byte in xrange(64))
+load_addr = 0x20000
+
+# Offsets of the fields that the tests corrupt.  The section headers
+# follow the code in the files that MakeElfFile() builds, and section
+# 1 is the code section.
+e_ident_offset = 0
+e_shoff_offset = 32
+e_shentsize_offset = 46
+code_section_offset = elf.header_size + len(code) + elf.section_size
+sh_offset_offset = code_section_offset + 16
+sh_size_offset = code_section_offset + 20
+
+
+def Patch(data, offset, fmt, value):
+  return data[:offset] + struct.pack(fmt, value) + \
+      data[offset + struct.calcsize(fmt):]
+
+
+def ListCodeSections(data):
+  return [(addr, offset, str(section))
+          for addr, offset, section in elf.GetCodeSections(data)]
+
+
+class ElfTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp(prefix='elf_test.')
+    self.data = elf.MakeElfFile(code, load_addr)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def WriteFile(self, data):
+    filename = os.path.join(self.temp_dir, 'test.o')
+    fh = open(filename, 'wb')
+    try:
+      fh.write(data)
+    finally:
+      fh.close()
+    return filename
+
+  def AssertRejected(self, data):
+    self.assertRaises(AssertionError, ListCodeSections, data)
+
+  def test_code_sections(self):
+    self.assertEquals(ListCodeSections(self.data),
+                      [(load_addr, elf.header_size, code)])
+    self.assertEquals(len(list(elf.GetSectionHeaders(self.data))), 2)
+
+  def test_sections_refer_to_mapping(self):
+    filename = self.WriteFile(self.data)
+    elf_file = elf.ElfFile(filename)
+    try:
+      sections = list(elf_file.CodeSections())
+      self.assertEquals(len(sections), 1)
+      addr, offset, section = sections[0]
+      self.assertTrue(isinstance(section, buffer))
+      self.assertEquals(str(section), code)
+      # Rewriting the file shows through the buffer, which would not
+      # happen if it held a copy of the section.
+      fh = open(filename, 'r+b')
+      try:
+        fh.seek(offset)
+        fh.write('\xcc' * 4)
+      finally:
+        fh.close()
+      self.assertEquals(str(section), '\xcc' * 4 + code[4:])
+    finally:
+      elf_file.Close()
+
+  def test_empty_file(self):
+    elf_file = elf.ElfFile(self.WriteFile(''))
+    try:
+      self.assertEquals(elf_file.data, '')
+      self.assertRaises(AssertionError, list, elf_file.CodeSections())
+    finally:
+      elf_file.Close()
+
+  def test_truncated(self):
+    for size in (0, 4, elf.header_size - 1, elf.header_size,
+                 len(self.data) - elf.section_size, len(self.data) - 1):
+      self.AssertRejected(self.data[:size])
+
+  def test_bad_ident(self):
+    self.AssertRejected(Patch(self.data, e_ident_offset, '4s', '\x7fELG'))
+    # ELFCLASS64 and ELFDATA2MSB.
+    self.AssertRejected(Patch(self.data, e_ident_offset + 4, 'B', 2))
+    self.AssertRejected(Patch(self.data, e_ident_offset + 5, 'B', 2))
+
+  def test_bad_section_header_offset(self):
+    for e_shoff in (len(self.data), len(self.data) - elf.section_size,
+                    0xffffffff):
+      self.AssertRejected(Patch(self.data, e_shoff_offset, '<I', e_shoff))
+    self.AssertRejected(Patch(self.data, e_shentsize_offset, '<H',
+                              elf.section_size - 1))
+
+  def test_bad_section(self):
+    self.AssertRejected(Patch(self.data, sh_offset_offset, '<I',
+                              len(self.data)))
+    self.AssertRejected(Patch(self.data, sh_offset_offset, '<I',
+                              0xffffffff))
+    self.AssertRejected(Patch(self.data, sh_size_offset, '<I',
+                              len(self.data)))
+    # The section may end exactly at the end of the file.
+    data = Patch(self.data, sh_size_offset, '<I',
+                 len(self.data) - elf.header_size)
+    self.assertEquals(ListCodeSections(data),
+                      [(load_addr, elf.header_size,
+                        data[elf.header_size:])])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -6,6 +6,7 @@ import re
 import subprocess
 
 import generator
+import trie_stages
 
 # This script attempts to list instructions that generator.py does not
 # know about (whether whitelisted or not).
@@ -59,7 +60,7 @@ def Main():
           instr = match.group(4)
           yield instr
 
-  root_node = generator.ExpandWildcards(generator.ConvertToDfa(
+  root_node = trie_stages.ExpandWildcards(trie_stages.ConvertToDfa(
       generator.GetRoot(nacl_mode=False)))
   for bytes, instr in zip(GetExamples(), GetInstrs()):
     if '(bad)' in instr:
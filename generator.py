@@ -2,15 +2,27 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import gc
+import multiprocessing
+import optparse
+import os
+import subprocess
+import sys
 import time
 
+import build_cache
+import build_profile
+import memoize
 from memoize import Memoize
 import objdump_check
 import trie
+import trie_stages
+from trie_stages import (DftLabel, DftLabels, MergeMany, NoMerge, TrieNode,
+                         TrieOfList)
 
 
 def Byte(x):
-  return '%02x' % x
+  return trie.byte_keys[x]
 
 
 regs32 = ('eax', 'ecx', 'edx', 'ebx', 'esp', 'ebp', 'esi', 'edi')
@@ -225,101 +237,6 @@ def ModRMSingleArg(rm_size, rm_allow_reg, rm_allow_mem, opcode, tail):
   return MergeMany(nodes, NoMerge)
 
 
-def TrieNode(children, accept=False):
-  node = trie.Trie()
-  node.children = children
-  node.accept = accept
-  return node
-
-
-def TrieOfList(bytes, node):
-  for byte in reversed(bytes):
-    node = TrieNode({byte: node})
-  return node
-
-
-class DftLabel(object):
-
-  def __init__(self, key, value, next):
-    self.key = key
-    self.value = value
-    self.next = next
-
-def DftLabels(pairs, node):
-  for key, value in pairs:
-    node = DftLabel(key, value, node)
-  return node
-
-
-# Assumes all the input nodes are immutable.
-def MergeMany(nodes, merge_accept_types):
-  if len(nodes) == 1:
-    return list(nodes)[0]
-  if len(nodes) == 0:
-    return trie.EmptyNode
-  children = {}
-  accept_types = set()
-
-  if isinstance(nodes[0], DftLabel):
-    for node in nodes:
-      AssertEq(node.key, nodes[0].key)
-      AssertEq(node.value, nodes[0].value)
-    return DftLabel(nodes[0].key,
-                    nodes[0].value,
-                    MergeMany([node.next for node in nodes],
-                              merge_accept_types))
-
-  by_key = {}
-  for node in nodes:
-    accept_types.add(node.accept)
-    for key, value in node.children.iteritems():
-      by_key.setdefault(key, []).append(value)
-  for key, subnodes in by_key.iteritems():
-    children[key] = MergeMany(subnodes, merge_accept_types)
-
-  if len(accept_types) == 1:
-    accept = list(accept_types)[0]
-  else:
-    accept = merge_accept_types(accept_types)
-  return trie.MakeInterned(children, accept)
-
-
-def TrieSize(start_node, expand_wildcards):
-  @Memoize
-  def Rec(node):
-    if isinstance(node, DftLabel):
-      return Rec(node.next)
-    x = 0
-    if node.accept:
-      x += 1
-    if expand_wildcards and 'XX' in node.children:
-      return x + 256 * Rec(node.children['XX'])
-    else:
-      for child in node.children.itervalues():
-        x += Rec(child)
-      return x
-
-  return Rec(start_node)
-
-
-def TrieNodeCount(root):
-  seen = set()
-  def Rec(node):
-    if node not in seen:
-      seen.add(node)
-      if isinstance(node, DftLabel):
-        Rec(node.next)
-      else:
-        for child in node.children.itervalues():
-          Rec(child)
-  Rec(root)
-  return len(seen)
-
-
-def NoMerge(x):
-  raise Exception('Cannot merge %r' % x)
-
-
 @Memoize
 def ImmediateNode(immediate_size):
   assert immediate_size in (0, 8, 16, 32), immediate_size
@@ -343,82 +260,6 @@ def PushLabels(labels, node):
                        for key, value in node.children.iteritems()))
 
 
-def FlattenTrie(node, bytes=[], labels=[]):
-  if isinstance(node, DftLabel):
-    for result in FlattenTrie(node.next, bytes, labels + [node]):
-      yield result
-  else:
-    if node.accept:
-      label_map = dict((label.key, label.value) for label in labels)
-      yield (bytes, label_map)
-    for byte, next in sorted(node.children.iteritems()):
-      for result in FlattenTrie(next, bytes + [byte], labels):
-        yield result
-
-
-# Convert from a transducer (with labels) to an acceptor (no labels).
-# Strip all labels, converting relative_jump labels into accept states.
-@Memoize
-def ConvertToDfa(node, accept_type='normal_inst'):
-  if isinstance(node, DftLabel):
-    if node.key == 'relative_jump':
-      assert accept_type == 'normal_inst'
-      accept_type = 'jump_rel%i' % node.value
-    return ConvertToDfa(node.next, accept_type)
-  else:
-    assert node.accept in (True, False)
-    if node.accept:
-      accept = accept_type
-    else:
-      accept = False
-    return trie.MakeInterned(dict((key, ConvertToDfa(value, accept_type))
-                                  for key, value in node.children.iteritems()),
-                             accept)
-
-
-# Expand wildcard bytes.  This has two benefits:
-#  * It allows wildcard edges to be merged with non-wildcards, in
-#    order to support the 'superinst_start' case.
-#  * It allows some nodes to be combined into one (combining explicit
-#    and implicit wildcards).
-@Memoize
-def ExpandWildcards(node):
-  if 'XX' in node.children:
-    assert len(node.children) == 1, node.children.keys()
-    dest = ExpandWildcards(node.children['XX'])
-    children = dict((Byte(byte), dest) for byte in xrange(256))
-  else:
-    children = dict((key, ExpandWildcards(value))
-                    for key, value in node.children.iteritems())
-  return trie.MakeInterned(children, node.accept)
-
-
-@Memoize
-def FilterModRM(node):
-  if isinstance(node, DftLabel):
-    if node.key == 'test_keep' and not node.value:
-      return trie.EmptyNode
-    return DftLabel(node.key, node.value, FilterModRM(node.next))
-  else:
-    children = {}
-    for key, value in node.children.iteritems():
-      value = FilterModRM(value)
-      if value != trie.EmptyNode:
-        children[key] = value
-    return TrieNode(children, node.accept)
-
-
-def FilterPrefix(bytes, node):
-  if len(bytes) == 0:
-    return node
-  elif isinstance(node, DftLabel):
-    return DftLabel(node.key, node.value, FilterPrefix(bytes, node.next))
-  else:
-    return TrieNode({bytes[0]: FilterPrefix(bytes[1:],
-                                            node.children[bytes[0]])},
-                    node.accept)
-
-
 def SubstSize(dec, size):
   def Subst(value):
     if value == 'imm8':
@@ -1369,122 +1210,329 @@ def GetCoreRoot(nacl_mode, mem_access_only=False, lockable_only=False,
   return MergeMany(top_nodes, NoMerge)
 
 
-def GetRoot(nacl_mode):
-  Log('Core instructions...')
-  core = GetCoreRoot(nacl_mode=nacl_mode)
-  Log('Memory access instructions...')
-  mem = TrieOfList(['65'], DftLabel('gs_prefix', None,
-                                    GetCoreRoot(nacl_mode=nacl_mode,
-                                                mem_access_only=True,
-                                                gs_access_only=True)))
-  Log('Locked instructions...')
-  lock = TrieOfList(['f0'], DftLabel('lock_prefix', None,
-                                     GetCoreRoot(nacl_mode=nacl_mode,
-                                                 mem_access_only=True,
-                                                 lockable_only=True)))
-  Log('Merge...')
-  return MergeMany([core, mem, lock], NoMerge)
+# The sub-tries that GetRoot() merges together.  Each entry gives a
+# log message, the prefix bytes and label to put in front of the
+# sub-trie, and the extra arguments to pass to GetCoreRoot().
+root_variants = [
+    ('Core instructions...', [], None, {}),
+    ('Memory access instructions...', ['65'], 'gs_prefix',
+     {'mem_access_only': True, 'gs_access_only': True}),
+    ('Locked instructions...', ['f0'], 'lock_prefix',
+     {'mem_access_only': True, 'lockable_only': True}),
+    ]
 
 
-def ExpandArg((do_expand, arg), label_map):
-  if do_expand:
-    return label_map['%s_arg' % arg]
-  else:
-    return arg
-
-def InstrFromLabels(label_map):
-  if 'gs_prefix' in label_map:
-    # Modifying the string to add 'gs:' is rather hacky, but it is
-    # probably not worth doing it more cleanly, because NaCl has been
-    # changed so that the %gs segment is only 4 bytes, and the
-    # validator will probably be changed to disallow all but the
-    # simplest %gs usage.
-    if 'rm_arg' in label_map:
-      label_map['rm_arg'] = \
-          label_map['rm_arg'].replace('ds:', 'gs:').replace('[', 'gs:[')
-    elif 'mem_arg' in label_map:
-      label_map['mem_arg'] = label_map['mem_arg'].replace('ds:', 'gs:')
-    else:
-      raise AssertionError('Bad gs prefix usage?')
-  instr_args = ','.join([' ' + ExpandArg(arg, label_map)
-                         for arg in label_map['args']])
-  instr = label_map['instr_name'] + instr_args
-  if 'lock_prefix' in label_map:
-    instr = 'lock ' + instr
-  return instr
-
-def GetAll(node):
-  for bytes, label_map in FlattenTrie(node):
-    yield (bytes, InstrFromLabels(label_map))
-
-
-def SandboxedJumps():
-  tail = trie.MakeInterned({}, 'normal_inst')
-  for reg in range(8):
-    if reg == 4:
-      # The original validator arbitrarily disallows %esp here.
-      continue
-    yield TrieOfList(map(Byte, [0x83, 0xe0 | reg, 0xe0,  # and $~31, %reg
-                                0xff, 0xe0 | reg]),      # jmp *%reg
-                     tail)
-    yield TrieOfList(map(Byte, [0x83, 0xe0 | reg, 0xe0,  # and $~31, %reg
-                                0xff, 0xd0 | reg]),      # call *%reg
-                     tail)
-
-
-def MergeAcceptTypes(accept_types):
-  if accept_types == set(['normal_inst', False]):
-    return 'superinst_start'
+def GetRootVariant(nacl_mode, prefix, label, kwargs):
+  node = GetCoreRoot(nacl_mode=nacl_mode, **kwargs)
+  if label is not None:
+    node = TrieOfList(prefix, DftLabel(label, None, node))
+  return node
+
+
+def GetRootVariantRecords((nacl_mode, index)):
+  # This runs in a worker process that only builds this trie, and the
+  # trie has no cycles, so the cyclic garbage collector would only
+  # slow it down.
+  gc.disable()
+  log_msg, prefix, label, kwargs = root_variants[index]
+  Log(log_msg)
+  return trie_stages.TrieToRecords(
+      GetRootVariant(nacl_mode, prefix, label, kwargs))
+
+
+# Builds the root_variants entries listed in "indexes" in a pool of
+# worker processes, and returns them in the same order.  The workers
+# send back records rather than nodes, and TrieFromRecords() interns
+# the nodes again in this process, so that sub-tries built in
+# different workers share their common nodes.
+#
+# Unpickling and re-interning the records costs this process about
+# 4.5us per node, which is more than building the current sub-tries
+# serially costs (about 2.4us per node, since they share memoized
+# sub-results).  So the pool is only worthwhile, given free cores, for
+# sub-tries that are slower to build than that per node they produce.
+def GetRootVariantsParallel(nacl_mode, indexes, processes):
+  pool = multiprocessing.Pool(processes)
+  try:
+    results = pool.map(GetRootVariantRecords,
+                       [(nacl_mode, index) for index in indexes],
+                       chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+  return [trie_stages.TrieFromRecords(records) for records in results]
+
+
+# If "processes" is greater than 1, the sub-tries are built in a pool
+# of that many worker processes.
+def GetRoot(nacl_mode, processes=1):
+  if processes > 1:
+    nodes = GetRootVariantsParallel(nacl_mode, range(len(root_variants)),
+                                    processes)
   else:
-    raise AssertionError('Cannot merge %r' % accept_types)
+    nodes = []
+    for log_msg, prefix, label, kwargs in root_variants:
+      Log(log_msg)
+      nodes.append(GetRootVariant(nacl_mode, prefix, label, kwargs))
+  Log('Merge...')
+  return MergeMany(nodes, NoMerge)
+
 
+def SourcePath(filename):
+  return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+
+
+# The source files that the stages in trie_stages.py run.  The sub-tries
+# built by generator.py also depend on generator.py itself.
+stage_sources = ('trie_stages.py', 'trie.py', 'memoize.py')
+
+
+def SourceDigest(filenames):
+  return build_cache.HashFiles([SourcePath(filename)
+                                for filename in filenames])
+
+
+# Returns (node, digest) where "digest" is a hash of the trie's
+# content.  "compute" is only called if the cache has no entry for
+# "key".
+def CachedTrieStage(cache, key, compute):
+  cached = cache.Get(key)
+  if cached is not None:
+    digest, records = cached
+    return trie_stages.TrieFromRecords(records), digest
+  return StoreTrieStage(cache, key, compute())
+
+
+def StoreTrieStage(cache, key, node):
+  digest = trie_stages.TrieDigest(node)
+  cache.Put(key, (digest, trie_stages.TrieToRecords(node)))
+  return node, digest
+
+
+# Like GetRoot(), but each sub-trie is cached, and only the sub-tries
+# that miss the cache are built in the pool.  Returns (node, digest).
+def GetRootCached(cache, nacl_mode, processes=1):
+  # We cannot tell which parts of generator.py GetCoreRoot() depends
+  # on, so the sub-tries are keyed on the whole of it.  The digest of
+  # the merged trie only depends on the sub-tries' content, so if an
+  # edit leaves them unchanged, the later stages still hit the cache.
+  source_digest = SourceDigest(('generator.py',) + stage_sources)
+  keys = [build_cache.HashValues('core', source_digest, nacl_mode, log_msg)
+          for log_msg, prefix, label, kwargs in root_variants]
+  cached = [cache.Get(key) for key in keys]
+  built = {}
+  missing = [index for index, value in enumerate(cached) if value is None]
+  if processes > 1 and len(missing) > 1:
+    built = dict(zip(missing, GetRootVariantsParallel(nacl_mode, missing,
+                                                      processes)))
+  nodes = []
+  digests = []
+  for index, (log_msg, prefix, label, kwargs) in enumerate(root_variants):
+    Log(log_msg)
+    if cached[index] is not None:
+      digest, records = cached[index]
+      node = trie_stages.TrieFromRecords(records)
+    else:
+      node = built.get(index)
+      if node is None:
+        node = GetRootVariant(nacl_mode, prefix, label, kwargs)
+      node, digest = StoreTrieStage(cache, keys[index], node)
+    nodes.append(node)
+    digests.append(digest)
+  Log('Merge...')
+  return (MergeMany(nodes, NoMerge),
+          build_cache.HashValues('merge', digests,
+                                 SourceDigest(stage_sources)))
+
+
+# Returns the version output of the tools that objdump_check.py runs.
+def ToolVersions():
+  return [subprocess.Popen([tool, '--version'],
+                           stdout=subprocess.PIPE).communicate()[0]
+          for tool in ('objdump', 'gcc')]
+
+
+# Runs objdump_check.DisassembleTest() on the instructions in each of
+# "tests", a list of (description, node) pairs, unless it has already
+# passed for a trie with the same content.  The remaining tests run
+# concurrently, and each is split into "shard_count" shards that are
+# checked in parallel.
+def CachedDisassembleTests(cache, tests, shard_count=1):
+  # A newer objdump or assembler may disagree with the trie, so a pass
+  # only counts for the versions it was checked with.
+  code_digests = (
+      SourceDigest(stage_sources + ('objdump_check.py',)),
+      ToolVersions())
+  pending = []
+  for description, node in tests:
+    key = build_cache.HashValues('disassemble_test',
+                                 trie_stages.TrieDigest(node),
+                                 *code_digests)
+    if cache.Get(key):
+      Log('%s: already checked' % description)
+    else:
+      Log('%s...' % description)
+      pending.append((description, node, key))
+
+  def MakeTest(node):
+    return lambda: objdump_check.DisassembleTest(
+        lambda: trie_stages.GetAll(node), bits=32, shard_count=shard_count)
+  results = objdump_check.RunConcurrently(
+      [MakeTest(node) for description, node, key in pending])
+  failed = []
+  for (description, node, key), passed in zip(pending, results):
+    if passed:
+      cache.Put(key, True)
+    else:
+      failed.append(description)
+  if len(failed) > 0:
+    raise Exception('Disassembly tests failed: %s' % ', '.join(failed))
+
+
+def Main(args):
+  parser = optparse.OptionParser()
+  parser.add_option('--no-cache', dest='use_cache', action='store_false',
+                    default=True,
+                    help='Rebuild every stage, ignoring %s'
+                    % build_cache.default_cache_dir)
+  parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+                    help='Number of processes to use for each objdump '
+                    'cross-check')
+  parser.add_option('--trie-jobs', dest='trie_jobs', type='int', default=1,
+                    help='Number of processes to use for building the '
+                    'sub-tries of the instruction trie that miss the '
+                    'build cache (default: %default)')
+  parser.add_option('--check-all', dest='check_all', action='store_true',
+                    default=False,
+                    help='Also cross-check every instruction in the trie '
+                    'with objdump, not just a subset of the ModRM bytes')
+  parser.add_option('--cache-size', dest='cache_size', type='int',
+                    default=build_cache.default_max_size >> 20,
+                    help='Size in MB to prune %s to after the build '
+                    '(default: %%default)' % build_cache.default_cache_dir)
+  parser.add_option('--profile-report', dest='profile_report', default=None,
+                    help='Write the time, memory use and node counts of '
+                    'each stage to this file, as JSON')
+  parser.add_option('--profile-dir', dest='profile_dir', default=None,
+                    help='Run each stage under cProfile, writing the '
+                    'statistics to this directory')
+  options, args = parser.parse_args(args)
+  assert len(args) == 0, args
+  cache = build_cache.BuildCache(enabled=options.use_cache)
+  profiler = build_profile.StageProfiler(options.profile_dir)
+  # The later stages are keyed on their input trie's digest and on the
+  # source that they run, which does not include generator.py.
+  source_digest = SourceDigest(stage_sources)
 
-def Main():
   Log('Building trie...')
-  trie_root = GetRoot(nacl_mode=True)
+  profiler.Start('build_trie')
+  trie_root, root_digest = GetRootCached(cache, nacl_mode=True,
+                                         processes=options.trie_jobs)
+  profiler.End()
+  # Each stage only uses its own memoized functions, so we clear the
+  # caches after each stage to let the nodes they hold be freed.
+  memoize.ClearAll()
+  node_count = trie_stages.TrieNodeCount(trie_root)
+  templates = trie_stages.TrieSize(trie_root, False)
+  profiler.AddCounts(nodes_after=node_count, templates=templates)
   Log('Size:')
-  Log(TrieSize(trie_root, False))
+  Log(templates)
   Log('Node count:')
-  Log(TrieNodeCount(trie_root))
+  Log(node_count)
   Log('Building test subset...')
-  filtered_trie = FilterModRM(trie_root)
+  profiler.Start('test_subset')
+  filtered_trie = trie_stages.FilterModRM(trie_root)
   Log('Testing...')
   fh = open('examples.list', 'w')
-  for bytes, labels in GetAll(filtered_trie):
+  for bytes, labels in trie_stages.GetAll(filtered_trie):
     fh.write('%s:%s\n' % (' '.join(bytes), labels))
   fh.close()
-  objdump_check.DisassembleTest(lambda: GetAll(filtered_trie), bits=32)
-
-  Log('Testing all ModRM bytes...')
-  objdump_check.DisassembleTest(
-      lambda: GetAll(FilterPrefix(['01'], trie_root)),
-      bits=32)
-  Log('Testing all ModRM bytes with gs...')
-  objdump_check.DisassembleTest(
-      lambda: GetAll(FilterPrefix(['65', '89'], trie_root)),
-      bits=32)
+  profiler.Start('disassemble_tests')
+  tests = [
+      ('Testing the test subset', filtered_trie),
+      ('Testing all ModRM bytes',
+       trie_stages.FilterPrefix(['01'], trie_root)),
+      ('Testing all ModRM bytes with gs',
+       trie_stages.FilterPrefix(['65', '89'], trie_root)),
+      ]
+  if options.check_all:
+    tests.append(('Testing all instructions', trie_root))
+  CachedDisassembleTests(cache, tests, shard_count=options.jobs)
+  profiler.End()
+  memoize.ClearAll()
 
   Log('Converting to DFA...')
-  dfa_root = ConvertToDfa(trie_root)
+  profiler.Start('convert_to_dfa')
+  dfa_root, dfa_digest = CachedTrieStage(
+      cache,
+      build_cache.HashValues('dfa', root_digest, source_digest),
+      lambda: trie_stages.ConvertToDfa(trie_root))
+  profiler.End()
+  memoize.ClearAll()
+  prev_count = node_count
+  node_count = trie_stages.TrieNodeCount(dfa_root)
+  profiler.AddCounts(nodes_before=prev_count, nodes_after=node_count)
   Log('DFA node count:')
-  Log(TrieNodeCount(dfa_root))
+  Log(node_count)
   Log('Expand wildcards...')
   # This is much faster as a separate pass that is applied after
   # ConvertToDfa(), because there are fewer nodes to apply the
   # expanding-out to.
-  dfa_root = ExpandWildcards(dfa_root)
+  profiler.Start('expand_wildcards')
+  dfa_root, dfa_digest = CachedTrieStage(
+      cache,
+      build_cache.HashValues('expand', dfa_digest, source_digest),
+      lambda: trie_stages.ExpandWildcards(dfa_root))
+  profiler.End()
+  memoize.ClearAll()
+  prev_count = node_count
+  node_count = trie_stages.TrieNodeCount(dfa_root)
+  profiler.AddCounts(nodes_before=prev_count, nodes_after=node_count)
   Log('DFA node count:')
-  Log(TrieNodeCount(dfa_root))
+  Log(node_count)
 
   Log('Adding jumps...')
-  dfa_root = MergeMany([dfa_root] + list(SandboxedJumps()), MergeAcceptTypes)
+  profiler.Start('add_jumps')
+  dfa_root, dfa_digest = CachedTrieStage(
+      cache,
+      build_cache.HashValues('jumps', dfa_digest, source_digest),
+      lambda: MergeMany([dfa_root] + list(trie_stages.SandboxedJumps()),
+                        trie_stages.MergeAcceptTypes))
+  profiler.End()
+  prev_count = node_count
+  node_count = trie_stages.TrieNodeCount(dfa_root)
+  profiler.AddCounts(nodes_before=prev_count, nodes_after=node_count)
   Log('DFA node count:')
-  Log(TrieNodeCount(dfa_root))
+  Log(node_count)
+  memoize.ClearAll()
+
+  Log('Minimizing...')
+  profiler.Start('minimize')
+  dfa_root, stats = trie.Minimize(dfa_root)
+  profiler.End()
+  profiler.AddCounts(nodes_before=stats['states_before'],
+                     nodes_after=stats['states_after'],
+                     dead_states=stats['dead_states'])
+  Log('DFA states: %(states_before)i before, %(states_after)i after '
+      '(%(dead_states)i dead)' % stats)
+  profiler.Start('write_table')
+  table = trie.TrieToTable(dfa_root)
+  Log('Byte classes: %i' % table.ClassCount())
   dest_file = 'x86_32.trie'
   Log('Dumping trie to %r...' % dest_file)
-  trie.WriteToFile(dest_file, dfa_root)
+  trie.WriteTableFile(dest_file, table)
+  profiler.End()
+  profiler.AddCounts(byte_classes=table.ClassCount())
+  Log('Build cache: %i hits, %i misses, %i old entries pruned'
+      % (cache.hits, cache.misses, cache.Prune(options.cache_size << 20)))
+  Log('Memoization caches:\n%s' % memoize.FormatStats(memoize.GetStats()))
+  if options.profile_report is not None:
+    profiler.WriteReport(options.profile_report,
+                         build_cache={'hits': cache.hits,
+                                      'misses': cache.misses})
+    Log('Wrote profile report to %r' % options.profile_report)
   Log('Done')
 
 
 if __name__ == '__main__':
-  Main()
+  Main(sys.argv[1:])
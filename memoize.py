@@ -2,16 +2,115 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import weakref
+
 
 NOT_FOUND = object()
 
+# The MemoInfo of every live memoized function, so that the caches can
+# be reported on and cleared between the stages of a pipeline.
+all_infos = weakref.WeakSet()
+
+
+class MemoInfo(object):
+
+  def __init__(self, name, max_size):
+    self.name = name
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.peak_size = 0
+    # Bounded caches keep two generations: [current, previous].
+    # Unbounded caches only use the first.
+    self.generations = [{}, {}]
 
-def Memoize(func):
-  cache = {}
-  def Wrapper(*args):
-    value = cache.get(args, NOT_FOUND)
-    if value is NOT_FOUND:
-      value = func(*args)
-      cache[args] = value
-    return value
+  def Size(self):
+    return len(self.generations[0]) + len(self.generations[1])
+
+  def Clear(self):
+    self.peak_size = max(self.peak_size, self.Size())
+    for generation in self.generations:
+      generation.clear()
+
+
+# Caches the results of "func", keyed on its arguments.  Trie nodes do
+# not define __eq__ or __hash__, so node arguments are keyed by
+# identity, which is cheap.
+#
+# If "max_size" is given, the cache is generational: when the current
+# generation has "max_size" entries, it becomes the previous
+# generation and the old previous generation is dropped.  Entries that
+# are hit in the previous generation are moved to the current one, so
+# this approximates LRU eviction with between "max_size" and 2 *
+# "max_size" entries.
+def Memoize(func, max_size=None):
+  info = MemoInfo(func.__name__, max_size)
+  generations = info.generations
+  if max_size is None:
+    cache = generations[0]
+    def Wrapper(*args):
+      value = cache.get(args, NOT_FOUND)
+      if value is NOT_FOUND:
+        info.misses += 1
+        value = func(*args)
+        cache[args] = value
+      else:
+        info.hits += 1
+      return value
+  else:
+    def Wrapper(*args):
+      current = generations[0]
+      value = current.get(args, NOT_FOUND)
+      if value is NOT_FOUND:
+        value = generations[1].pop(args, NOT_FOUND)
+        if value is NOT_FOUND:
+          info.misses += 1
+          value = func(*args)
+        else:
+          info.hits += 1
+        if len(current) >= max_size:
+          info.peak_size = max(info.peak_size, info.Size())
+          info.evictions += len(generations[1])
+          generations[1] = current
+          generations[0] = current = {}
+        current[args] = value
+      else:
+        info.hits += 1
+      return value
+  Wrapper.info = info
+  Wrapper.__name__ = func.__name__
+  all_infos.add(info)
   return Wrapper
+
+
+def BoundedMemoize(max_size):
+  def Decorator(func):
+    return Memoize(func, max_size=max_size)
+  return Decorator
+
+
+def ClearAll():
+  for info in list(all_infos):
+    info.Clear()
+
+
+# Returns the MemoInfo of every live memoized function, with the
+# busiest caches first.
+def GetStats():
+  return sorted(all_infos, key=lambda info: (-(info.hits + info.misses),
+                                             info.name))
+
+
+def FormatStats(infos):
+  lines = ['%-24s %10s %10s %8s %10s %10s'
+           % ('function', 'hits', 'misses', 'hit%', 'size', 'peak')]
+  for info in infos:
+    calls = info.hits + info.misses
+    if calls == 0:
+      continue
+    lines.append('%-24s %10i %10i %7.1f%% %10i %10i'
+                 % (info.name, info.hits, info.misses,
+                    100.0 * info.hits / calls, info.Size(),
+                    max(info.peak_size, info.Size())))
+  return '\n'.join(lines)
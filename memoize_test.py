@@ -0,0 +1,105 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest
+
+import memoize
+
+
+# Returns a memoized function that records the arguments that it is
+# actually called with.
+def MakeFunc(max_size=None):
+  calls = []
+  def Double(x):
+    calls.append(x)
+    return x * 2
+  return memoize.Memoize(Double, max_size=max_size), calls
+
+
+class MemoizeTest(unittest.TestCase):
+
+  def test_hits_and_misses(self):
+    func, calls = MakeFunc()
+    self.assertEquals([func(x) for x in (1, 2, 1, 1, 3)], [2, 4, 2, 2, 6])
+    self.assertEquals(calls, [1, 2, 3])
+    self.assertEquals((func.info.hits, func.info.misses), (2, 3))
+    self.assertEquals(func.info.Size(), 3)
+    self.assertEquals(func.__name__, 'Double')
+    # None is a valid result, which is cached like any other.
+    none_calls = []
+    def ReturnNone(x):
+      none_calls.append(x)
+    func = memoize.Memoize(ReturnNone)
+    func(1)
+    func(1)
+    self.assertEquals(none_calls, [1])
+
+  def test_bounded_generations(self):
+    func, calls = MakeFunc(max_size=2)
+    func(1)
+    func(2)
+    self.assertEquals(func.info.generations, [{(1,): 2, (2,): 4}, {}])
+    # The current generation is full, so it becomes the previous one.
+    func(3)
+    self.assertEquals(func.info.generations, [{(3,): 6}, {(1,): 2, (2,): 4}])
+    # A hit in the previous generation moves the entry to the current
+    # one, without calling the function again.
+    self.assertEquals(func(1), 2)
+    self.assertEquals(func.info.generations, [{(3,): 6, (1,): 2},
+                                              {(2,): 4}])
+    self.assertEquals(calls, [1, 2, 3])
+    self.assertEquals((func.info.hits, func.info.misses), (1, 3))
+    self.assertEquals(func.info.evictions, 0)
+    # This time the previous generation's remaining entry is dropped.
+    func(4)
+    self.assertEquals(func.info.generations, [{(4,): 8}, {(3,): 6, (1,): 2}])
+    self.assertEquals(func.info.evictions, 1)
+    self.assertEquals(func.info.peak_size, 3)
+    func(2)
+    self.assertEquals(calls, [1, 2, 3, 4, 2])
+    self.assertEquals((func.info.hits, func.info.misses), (1, 5))
+
+  def test_bounded_memoize_decorator(self):
+    @memoize.BoundedMemoize(10)
+    def Square(x):
+      return x * x
+    self.assertEquals(Square(3), 9)
+    self.assertEquals(Square.info.max_size, 10)
+    self.assertEquals(Square.__name__, 'Square')
+
+  def test_clear_all(self):
+    unbounded, unbounded_calls = MakeFunc()
+    bounded, bounded_calls = MakeFunc(max_size=2)
+    for func in (unbounded, bounded):
+      for x in (1, 2, 3):
+        func(x)
+    self.assertEquals(unbounded.info.Size(), 3)
+    self.assertEquals(bounded.info.Size(), 3)
+    memoize.ClearAll()
+    for func in (unbounded, bounded):
+      self.assertEquals(func.info.Size(), 0)
+      self.assertEquals(func.info.generations, [{}, {}])
+      # The peak size is kept for reporting.
+      self.assertEquals(func.info.peak_size, 3)
+    # The functions still work, and recompute their results.
+    self.assertEquals((unbounded(1), bounded(1)), (2, 2))
+    self.assertEquals(unbounded_calls, [1, 2, 3, 1])
+    self.assertEquals(bounded_calls, [1, 2, 3, 1])
+
+  def test_stats(self):
+    busy, calls = MakeFunc()
+    for x in (1, 1, 1, 2):
+      busy(x)
+    idle, calls = MakeFunc()
+    self.assertTrue(busy.info in memoize.GetStats())
+    self.assertTrue(idle.info in memoize.GetStats())
+    report = memoize.FormatStats([busy.info, idle.info])
+    # Functions that were not called are left out.
+    self.assertEquals(report.splitlines()[1:],
+                      ['Double                            2          2'
+                       '    50.0%          2          2'])
+
+
+if __name__ == '__main__':
+  unittest.main()
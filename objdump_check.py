@@ -2,9 +2,13 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import multiprocessing
+import os
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
 
 
 def MapWildcard(byte):
@@ -25,7 +29,81 @@ def FillOutValues(desc):
           .replace('VALUE8', '0x11'))
 
 
-def DisassembleTestCallback(get_instructions, bits):
+# The raw bytes of each byte string, with wildcards filled in.
+byte_chars = dict(('%02x' % value, chr(value)) for value in xrange(256))
+byte_chars['XX'] = byte_chars[MapWildcard('XX')]
+
+# objdump's names for the architectures, for disassembling raw bytes.
+objdump_machines = {32: 'i386', 64: 'i386:x86-64'}
+
+
+# Instructions are dealt out to the shards in blocks of this many, so
+# that each shard gets a similar mix of instructions.
+shard_block_size = 4096
+
+
+# The files for one shard of the instructions being tested.
+class Shard(object):
+
+  def __init__(self, temp_dir, index):
+    self.index = index
+    self.dec_path = os.path.join(temp_dir, 'dec%i.bin' % index)
+    self.enc_path = os.path.join(temp_dir, 'enc%i.S' % index)
+    self.list_path = os.path.join(temp_dir, 'instrs%i.list' % index)
+    self.enc_fh = open(self.enc_path, 'w')
+    self.enc_fh.write('.intel_syntax noprefix\n')
+    self.list_fh = open(self.list_path, 'w')
+    # The disassembler reads the instructions' bytes directly, so they
+    # do not need to go through the assembler.  We write them out in
+    # one go at the end.
+    self.dec_chunks = []
+
+  def Add(self, bytes, desc):
+    self.dec_chunks.append(''.join([byte_chars[byte] for byte in bytes]))
+    if eiz_regexp.search(desc) is None and not desc.startswith('FIXME'):
+      self.enc_fh.write(FillOutValues(desc + '\n'))
+    self.list_fh.write('%s:%s\n' % (' '.join(bytes), desc))
+
+  def Close(self):
+    # Add a final instruction otherwise we do not catch length
+    # mismatches on the last input instruction.
+    self.Add(['90'], 'nop')
+    self.enc_fh.close()
+    self.list_fh.close()
+    dec_fh = open(self.dec_path, 'wb')
+    dec_fh.write(''.join(self.dec_chunks))
+    dec_fh.close()
+    # Drop the things that are not needed, and cannot be pickled, when
+    # the shard is sent to a worker process.
+    self.enc_fh = None
+    self.list_fh = None
+    self.dec_chunks = None
+
+
+# Maps the index of an instruction within a shard to its index in the
+# whole test, given how DisassembleTestCallback() deals out blocks.
+def GlobalIndex(shard_index, shard_count, index):
+  block, offset = divmod(index, shard_block_size)
+  return (block * shard_count + shard_index) * shard_block_size + offset
+
+
+# Checks one shard.  This runs in a worker process, so it returns the
+# failures rather than printing them, so that the failures of all the
+# shards can be reported in order.  Returns (failures, assembler_rc).
+def CheckShard((shard, shard_count, bits)):
+  # Assemble while we are disassembling.
+  enc_proc = subprocess.Popen(['gcc', '-c', '-m%i' % bits, shard.enc_path,
+                               '-o', shard.enc_path[:-2] + '.o'])
+  try:
+    failures = list(CrossCheck(
+        shard.dec_path, shard.list_path, bits,
+        lambda index: GlobalIndex(shard.index, shard_count, index)))
+  finally:
+    rc = enc_proc.wait()
+  return failures, rc
+
+
+def DisassembleTestCallback(get_instructions, bits, shard_count=1):
   # The main purpose of this test is to run instructions through the
   # disassembler.  But we *also* run them through the assembler as a
   # sanity check, because sometimes the assembler is stricter than the
@@ -33,33 +111,48 @@ def DisassembleTestCallback(get_instructions, bits):
   # instruction 'movlpd %xmm7, %xmm7' but the disassembler does not.
   # However, we do not check the assembler's output because encodings
   # can be non-canonical.
-  asm_dec_fh = open('tmp_dec.S', 'w')
-  asm_enc_fh = open('tmp_enc.S', 'w')
-  asm_enc_fh.write('.intel_syntax noprefix\n')
-  list_fh = open('tmp.list', 'w')
+  #
+  # The instructions are split into "shard_count" shards, which are
+  # assembled and disassembled in parallel.  The files go in a
+  # temporary directory so that several tests can run at the same
+  # time.  It is kept if the test fails.
+  temp_dir = tempfile.mkdtemp(prefix='objdump_check.')
+  shards = [Shard(temp_dir, index) for index in xrange(shard_count)]
   count = [0]
 
   def Callback(bytes, desc):
-    escaped_bytes = ''.join('\\x' + MapWildcard(byte) for byte in bytes)
-    asm_dec_fh.write('.ascii "%s"\n' % escaped_bytes)
-    if eiz_regexp.search(desc) is None and not desc.startswith('FIXME'):
-      asm_enc_fh.write(FillOutValues(desc + '\n'))
-    list_fh.write('%s:%s\n' % (' '.join(bytes), desc))
+    block = count[0] // shard_block_size
+    shards[block % shard_count].Add(bytes, desc)
     count[0] += 1
 
   get_instructions(Callback)
   print 'Checking %i instructions...' % count[0]
-  # Add a final instruction otherwise we do not catch length
-  # mismatches on the last input instruction.
-  Callback(['90'], 'nop')
-  asm_dec_fh.close()
-  asm_enc_fh.close()
-  list_fh.close()
-  subprocess.check_call(['gcc', '-c', '-m%i' % bits, 'tmp_dec.S',
-                         '-o', 'tmp_dec.o'])
-  CrossCheck('tmp_dec.o', 'tmp.list')
-  subprocess.check_call(['gcc', '-c', '-m%i' % bits, 'tmp_enc.S',
-                         '-o', 'tmp_enc.o'])
+  for shard in shards:
+    shard.Close()
+
+  tasks = [(shard, shard_count, bits) for shard in shards]
+  if shard_count == 1:
+    results = map(CheckShard, tasks)
+  else:
+    pool = multiprocessing.Pool(shard_count)
+    try:
+      results = pool.map(CheckShard, tasks)
+    finally:
+      pool.close()
+      pool.join()
+
+  failures = sorted(failure for shard_failures, rc in results
+                    for failure in shard_failures)
+  for index, message in failures:
+    print message
+  assembler_failed = any(rc != 0 for shard_failures, rc in results)
+  if len(failures) > 0 or assembler_failed:
+    print 'Test files kept in %s' % temp_dir
+  if len(failures) > 0:
+    raise Exception('Cross check failed')
+  if assembler_failed:
+    raise Exception('Assembling the instructions failed')
+  shutil.rmtree(temp_dir)
 
 
 whitespace_regexp = re.compile('\s+')
@@ -81,17 +174,21 @@ def NormaliseObjdumpDisasm(disasm):
   return disasm
 
 
-def ReadObjdump(obj_file):
+objdump_line_regexp = re.compile('0x([0-9a-f]+)\s*(.*?)\s*$')
+
+
+# Disassembles a file of raw instruction bytes.
+def ReadObjdump(bin_file, bits):
   proc = subprocess.Popen(['objdump', '-M', 'intel', '--prefix-addresses',
-                           '-d', obj_file],
-                          stdout=subprocess.PIPE)
-  regexp = re.compile('0x([0-9a-f]+)\s*')
+                           '-b', 'binary', '-m', objdump_machines[bits],
+                           '-D', bin_file],
+                          stdout=subprocess.PIPE, bufsize=-1)
+  match = objdump_line_regexp.match
   for line in proc.stdout:
-    match = regexp.match(line)
-    if match is not None:
-      addr = int(match.group(1), 16)
-      disasm = line[match.end():].rstrip()
-      yield addr, disasm
+    result = match(line)
+    if result is not None:
+      addr, disasm = result.groups()
+      yield int(addr, 16), disasm
   assert proc.wait() == 0, proc.wait()
 
 
@@ -112,21 +209,39 @@ def ReadListFile(fh):
     yield bytes.split(' '), desc
 
 
-def CrossCheck(obj_file, list_file):
-  objdump_iter = MungeData16(ReadObjdump(obj_file))
+# Yields (index, message) for each instruction that objdump does not
+# disassemble as expected.  "global_index" maps indexes in "list_file"
+# to the indexes that are reported.  After a length mismatch, the
+# remaining addresses are out of step, so we stop there.
+#
+# Since this is a generator, a StopIteration from objdump_iter.next()
+# would end it quietly, so we catch it and report the failure.
+def CrossCheck(bin_file, list_file, bits, global_index=lambda index: index):
+  objdump_iter = MungeData16(ReadObjdump(bin_file, bits))
   expected_addr = 0
   prev_length = 0
-  failed = False
   for index, (bytes, desc) in enumerate(ReadListFile(open(list_file))):
-    got_addr, disasm_orig = objdump_iter.next()
+    try:
+      got_addr, disasm_orig = objdump_iter.next()
+    except StopIteration:
+      # The previous instruction was probably longer than expected,
+      # and used up the bytes of this one.
+      yield (global_index(index),
+             'objdump output ended early, at %r (%s)'
+             % (desc, ' '.join(bytes)))
+      return
     if got_addr != expected_addr:
+      if index == 0:
+        yield (global_index(index),
+               'First instruction is at address %i, expected %i'
+               % (got_addr, expected_addr))
+        return
       # This only catches mismatches on the previous instruction,
       # which is why we added an extra final instruction earlier.
-      print 'Length mismatch on previous instruction: got %i, expected %i' % (
-          prev_length + got_addr - expected_addr,
-          prev_length)
-      failed = True
-      break
+      yield (global_index(index - 1),
+             'Length mismatch on previous instruction: got %i, expected %i'
+             % (prev_length + got_addr - expected_addr, prev_length))
+      return
     expected_addr += len(bytes)
     prev_length = len(bytes)
 
@@ -135,18 +250,30 @@ def CrossCheck(obj_file, list_file):
       # Some instructions are not handled correctly by binutils.
       continue
     if desc != disasm:
-      print 'Mismatch (%i): %r != %r (%r) (%s)' % (
-        index, desc, disasm, disasm_orig, ' '.join(bytes))
-      failed = True
-  if failed:
-    raise Exception('Cross check failed')
+      yield (global_index(index),
+             'Mismatch (%i): %r != %r (%r) (%s)' % (
+                 global_index(index), desc, disasm, disasm_orig,
+                 ' '.join(bytes)))
 
 
-def DisassembleTest(get_instructions, bits):
+def DisassembleTest(get_instructions, bits, shard_count=1):
   def Func(callback):
     for bytes, desc in get_instructions():
       callback(bytes, desc)
-  DisassembleTestCallback(Func, bits)
+  DisassembleTestCallback(Func, bits, shard_count)
+
+
+# Runs each of "funcs" in a child process of its own, so that the
+# tests can use several CPUs.  The children are forked, so the
+# functions and the tries they use do not need to be pickled.  Returns
+# a list of whether each function succeeded.
+def RunConcurrently(funcs):
+  procs = [multiprocessing.Process(target=func) for func in funcs]
+  for proc in procs:
+    proc.start()
+  for proc in procs:
+    proc.join()
+  return [proc.exitcode == 0 for proc in procs]
 
 
 def Main(args):
@@ -0,0 +1,66 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import objdump_check
+
+
+class CrossCheckTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp(prefix='objdump_check_test.')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  # Runs CrossCheck() on a list of (bytes, desc) pairs, followed by a
+  # nop, as DisassembleTestCallback() adds.
+  def CrossCheck(self, instrs):
+    instrs = instrs + [(['90'], 'nop')]
+    bin_file = os.path.join(self.temp_dir, 'dec.bin')
+    list_file = os.path.join(self.temp_dir, 'instrs.list')
+    fh = open(bin_file, 'wb')
+    for bytes, desc in instrs:
+      fh.write(''.join(objdump_check.byte_chars[byte] for byte in bytes))
+    fh.close()
+    fh = open(list_file, 'w')
+    for bytes, desc in instrs:
+      fh.write('%s:%s\n' % (' '.join(bytes), desc))
+    fh.close()
+    return list(objdump_check.CrossCheck(bin_file, list_file, 32))
+
+  def test_match(self):
+    self.assertEquals(
+        self.CrossCheck([(['e9', 'XX', 'XX', 'XX', 'XX'], 'jmp JUMP_DEST'),
+                         (['31', 'c0'], 'xor eax, eax')]),
+        [])
+
+  def test_mismatch(self):
+    failures = self.CrossCheck([(['31', 'c0'], 'xor ebx, ebx')])
+    self.assertEquals(len(failures), 1)
+    self.assertEquals(failures[0][0], 0)
+    self.assertTrue(failures[0][1].startswith('Mismatch'), failures)
+
+  def test_length_mismatch(self):
+    failures = self.CrossCheck([(['31'], 'xor eax, eax'),
+                                (['c0'], 'nop')])
+    self.assertEquals(len(failures), 1)
+    self.assertEquals(failures[0][0], 0)
+    self.assertTrue(failures[0][1].startswith('Length mismatch'), failures)
+
+  def test_objdump_output_ends_early(self):
+    # objdump reads the final nop as part of the jump, so it outputs
+    # one instruction fewer than the list file has.
+    failures = self.CrossCheck([(['e9', 'XX', 'XX', 'XX'], 'jmp JUMP_DEST')])
+    self.assertEquals(len(failures), 1)
+    self.assertEquals(failures[0][0], 1)
+    self.assertTrue('ended early' in failures[0][1], failures)
+
+
+if __name__ == '__main__':
+  unittest.main()
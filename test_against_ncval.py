@@ -6,6 +6,7 @@ import os
 import subprocess
 
 import generator
+import trie_stages
 
 
 bundle_size = 32
@@ -15,16 +16,16 @@ bits = 32
 
 def GetInstructions():
   root = generator.GetRoot(nacl_mode=True)
-  root = generator.FilterModRM(root)
-  for bytes, label_map in generator.FlattenTrie(root):
+  root = trie_stages.FilterModRM(root)
+  for bytes, label_map in trie_stages.FlattenTrie(root):
     label_map['align_to_end'] = (label_map['instr_name'] == 'call')
     yield bytes, label_map
 
   # TODO: It would be better if we tested the final DFA, rather than
   # enumerating the superinstructions here separately.
-  indirect_jumps = generator.MergeMany(list(generator.SandboxedJumps()),
-                                       generator.NoMerge)
-  for bytes, label_map in generator.FlattenTrie(indirect_jumps):
+  indirect_jumps = trie_stages.MergeMany(list(trie_stages.SandboxedJumps()),
+                                         trie_stages.NoMerge)
+  for bytes, label_map in trie_stages.FlattenTrie(indirect_jumps):
     label_map['align_to_end'] = True # Aligns the jmps unnecessarily
     yield bytes, label_map
 
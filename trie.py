@@ -2,7 +2,11 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import array
+import ctypes
 import json
+import mmap
+import struct
 import sys
 import time
 import weakref
@@ -12,14 +16,32 @@ import memoize
 
 class Trie(object):
 
+  # There can be hundreds of thousands of nodes, so we avoid having a
+  # __dict__ per node.  __weakref__ is needed for the "interned" table.
+  __slots__ = ('accept', 'children', '__weakref__')
+
   def __init__(self):
     self.accept = False
     self.children = {}
 
 
+# The edge labels: the 256 byte values as two-digit hex strings, plus
+# 'XX' for wildcards.  Using a single shared string object for each
+# label, rather than formatting a new string for every edge, saves
+# memory and makes dict lookups succeed on the identity check.
+byte_keys = tuple(intern('%02x' % byte) for byte in xrange(256))
+wildcard_key = intern('XX')
+canonical_keys = dict((key, key) for key in byte_keys + (wildcard_key,))
+
+
+def CanonicalKey(key):
+  return canonical_keys.get(key, key)
+
+
 def Add(root, bytes, instr):
   node = root
   for byte in bytes:
+    byte = CanonicalKey(byte)
     if byte not in node.children:
       new = Trie()
       node.children[byte] = new
@@ -29,8 +51,12 @@ def Add(root, bytes, instr):
 
 interned = weakref.WeakValueDictionary()
 
+# The key is a frozenset of the edges rather than a sorted tuple: this
+# is linear in the number of children rather than O(k log k), and a
+# frozenset caches its own hash.  Nodes hash by identity, so hashing
+# the edges does not recurse into the children.
 def MakeInterned(children, accept):
-  key = (accept, tuple(sorted(children.iteritems())))
+  key = (accept, frozenset(children.iteritems()))
   node = interned.get(key)
   if node is None:
     node = Trie()
@@ -86,6 +112,106 @@ def MergeMany(nodes, merge_accept_types):
   return MakeInterned(children, accept)
 
 
+# Returns the node that a full row of 256 byte edges leads to, if the
+# edges all lead to the same node, or None otherwise.  Most rows fail
+# the length check, and the rest stop at the first edge that differs,
+# so this does not build a set of the destinations.
+def UniformTarget(children):
+  if len(children) != 256 or wildcard_key in children:
+    return None
+  dests = children.itervalues()
+  dest = dests.next()
+  for other in dests:
+    if other is not dest:
+      return None
+  return dest
+
+
+# The edges of a node, for comparing nodes by the language they
+# accept: 256 byte edges to the same node are equivalent to one
+# wildcard edge.
+def EdgeSignature(children):
+  dest = UniformTarget(children)
+  if dest is not None:
+    return frozenset([(wildcard_key, dest)])
+  return frozenset(children.iteritems())
+
+
+# Turns implicit (expanded-out) wildcards back into explicit 'XX'
+# edges.  Explicit wildcards are better when enumerating instructions
+# or comparing tries.  Each node is visited once, and a node whose
+# subtrie has no expanded wildcards is returned as it is rather than
+# being re-interned.
+def SimplifyWildcards(root):
+  @memoize.Memoize
+  def Rec(node):
+    dest = UniformTarget(node.children)
+    if dest is not None:
+      return MakeInterned({wildcard_key: Rec(dest)}, node.accept)
+    children = {}
+    changed = False
+    for key, child in node.children.iteritems():
+      new_child = Rec(child)
+      children[key] = new_child
+      if new_child is not child:
+        changed = True
+    if not changed:
+      return node
+    return MakeInterned(children, node.accept)
+
+  return Rec(root)
+
+
+# Returns a minimal acyclic DFA equivalent to "root", along with a
+# dict of statistics.
+#
+# Interning already shares structurally identical subtries, but the
+# result need not be minimal: a subtrie may have no accepting states
+# at all without being EmptyNode, and a wildcard edge may sit in one
+# subtrie where an equivalent expanded set of 256 edges sits in
+# another.  This follows Revuz's algorithm: nodes are processed in
+# order of height, so that each node's children have already been
+# replaced by their representatives, and nodes are then merged if they
+# have the same accept value and edge signature.
+def Minimize(root):
+  @memoize.Memoize
+  def Height(node):
+    return 1 + max([-1] + [Height(child)
+                           for child in node.children.itervalues()])
+
+  nodes = GetAllNodes(root)
+  # Maps each node to its representative, or to None if it is dead
+  # (accepts nothing).
+  replacement = {}
+  representatives = {}
+  dead_count = 0
+  for node in sorted(nodes, key=Height):
+    children = {}
+    for key, child in node.children.iteritems():
+      child = replacement[child]
+      if child is not None:
+        children[key] = child
+    if len(children) == 0 and not node.accept:
+      replacement[node] = None
+      dead_count += 1
+      continue
+    signature = (node.accept, EdgeSignature(children))
+    representative = representatives.get(signature)
+    if representative is None:
+      representative = MakeInterned(children, node.accept)
+      representatives[signature] = representative
+    replacement[node] = representative
+
+  new_root = replacement[root]
+  if new_root is None:
+    new_root = EmptyNode
+  stats = {'states_before': len(nodes),
+           'states_after': len(GetAllNodes(new_root)),
+           'dead_states': dead_count,
+           'height': Height(root)}
+  return new_root, stats
+
+
 def Pr(node, stream, indent=0):
   ind = '  ' * indent
   if node.accept:
@@ -154,7 +280,7 @@ def Main(args):
   root = Merge(root, batch)
 
   output_filename = '%s.trie' % filename
-  WriteToFile(output_filename, root)
+  WriteJsonFile(output_filename, root)
 
 
 def TrieToDict(root):
@@ -173,36 +299,324 @@ def TrieToDict(root):
 def TrieFromDict(trie_data):
   @memoize.Memoize
   def MakeNode(node_id):
+    # JSON gives us unicode keys, but the rest of the code uses str.
     children = dict(
-        (key, MakeNode(child_id))
+        (CanonicalKey(str(key)), MakeNode(child_id))
         for key, child_id in trie_data['map'][node_id].iteritems())
     return MakeInterned(children, trie_data['accepts'][node_id])
 
   return MakeNode(trie_data['start'])
 
 
+# The binary trie file format.  This stores the DFA as a dense
+# transition table, so that loading it does not require parsing and
+# re-interning every node.  The layout is:
+#
+#   header: magic, then (version, entry_size, state_count, start_state,
+#       accept_table_size) as little-endian uint32s.
+#   accept table: a JSON list of the distinct accept values.  Entry 0
+#       is always False.
+#   accept indexes: one uint8 per state, indexing the accept table.
+#   wildcard flags: one uint8 per state, set if the state has a single
+#       'XX' edge rather than explicit byte edges.
+#   transitions: state_count * 256 entries of entry_size bytes each
+#       (1 if there are at most 256 states, otherwise 2), little-endian.
+#   byte classes (version 2 onwards): one uint8 per byte value, giving
+#       its byte class (see ComputeByteClasses()).
+#
+# State 0 is the rejecting state: all of its transitions lead to itself.
+
+binary_magic = 'NACLDFA\0'
+binary_version = 2
+binary_header_format = '<8sIIIII'
+
+
+class DfaTable(object):
+
+  def __init__(self, start, accepts, wildcards, transitions,
+               byte_classes=None):
+    self.start = start
+    # The accept value of each state.
+    self.accepts = accepts
+    # Whether each state's outgoing edges come from an 'XX' edge.
+    self.wildcards = wildcards
+    # A flat array of state_count * 256 destination states.
+    self.transitions = transitions
+    # The byte class of each byte value.
+    if byte_classes is None:
+      byte_classes = ComputeByteClasses(self)
+    self.byte_classes = byte_classes
+
+  def StateCount(self):
+    return len(self.accepts)
+
+  def ClassCount(self):
+    return max(self.byte_classes) + 1
+
+  def NextState(self, state, byte):
+    return self.transitions[state * 256 + byte]
+
+  def AcceptType(self, state):
+    return self.accepts[state]
+
+
+# Two bytes are in the same byte class if every state has the same
+# transition for both of them.  Consumers can then work with one
+# representative byte per class rather than with all 256 bytes.  This
+# returns a list mapping each byte to its class.  Classes are numbered
+# in order of their lowest byte, so byte 0 is always in class 0.
+def ComputeByteClasses(table):
+  state_count = table.StateCount()
+  transitions = table.transitions
+  column_to_class = {}
+  byte_classes = []
+  for byte in xrange(256):
+    column = tuple(transitions[state * 256 + byte]
+                   for state in xrange(state_count))
+    byte_classes.append(column_to_class.setdefault(column,
+                                                   len(column_to_class)))
+  return byte_classes
+
+
+# Returns a list of the byte classes, each given as a sorted list of
+# bytes.
+def ByteClassMembers(byte_classes):
+  members = [[] for index in xrange(max(byte_classes) + 1)]
+  for byte, byte_class in enumerate(byte_classes):
+    members[byte_class].append(byte)
+  return members
+
+
+# Returns the coarsest byte classes that refine both of the given
+# classifications, for working on two DFAs at once.
+def RefineByteClasses(byte_classes1, byte_classes2):
+  pair_to_class = {}
+  return [pair_to_class.setdefault(pair, len(pair_to_class))
+          for pair in zip(byte_classes1, byte_classes2)]
+
+
+def TrieToTable(root):
+  nodes = [EmptyNode] + [node for node in GetAllNodes(root)
+                         if node is not EmptyNode]
+  node_to_id = dict((node, index) for index, node in enumerate(nodes))
+  if len(nodes) <= 256:
+    typecode = 'B'
+  else:
+    typecode = 'H'
+  transitions = array.array(typecode, [0] * (len(nodes) * 256))
+  wildcards = []
+  for node_id, node in enumerate(nodes):
+    base = node_id * 256
+    if 'XX' in node.children:
+      assert len(node.children) == 1, (
+          'Cannot mix wildcard and non-wildcard edges: %r'
+          % sorted(node.children.keys()))
+      dest_id = node_to_id[node.children['XX']]
+      for byte in xrange(256):
+        transitions[base + byte] = dest_id
+      wildcards.append(True)
+    else:
+      for byte, dest_node in node.children.iteritems():
+        transitions[base + int(byte, 16)] = node_to_id[dest_node]
+      wildcards.append(False)
+  return DfaTable(node_to_id[root], [node.accept for node in nodes],
+                  wildcards, transitions)
+
+
+# If "simplify_wildcards" is true, a state whose transitions all lead
+# to the same (non-rejecting) state gets an 'XX' edge, as with
+# SimplifyWildcards().  This is checked on the table's row, which is
+# cheaper than checking the node's edges afterwards.
+def TableToTrie(table, simplify_wildcards=False):
+  @memoize.Memoize
+  def MakeNode(state):
+    base = state * 256
+    row = table.transitions[base:base + 256]
+    dest = row[0]
+    if (table.wildcards[state] or
+        (simplify_wildcards and dest != 0 and row.count(dest) == 256)):
+      children = {wildcard_key: MakeNode(dest)}
+    else:
+      children = {}
+      for byte, dest in enumerate(row):
+        if dest != 0:
+          children[byte_keys[byte]] = MakeNode(dest)
+    return MakeInterned(children, table.accepts[state])
+
+  return MakeNode(table.start)
+
+
+def WriteTableFile(output_filename, table):
+  accept_table = [False]
+  for accept in table.accepts:
+    if accept not in accept_table:
+      accept_table.append(accept)
+  assert len(accept_table) <= 256
+  accept_table_data = json.dumps(accept_table)
+  transitions = table.transitions
+  if sys.byteorder == 'big':
+    transitions = array.array(transitions.typecode, transitions)
+    transitions.byteswap()
+  fh = open(output_filename, 'wb')
+  fh.write(struct.pack(binary_header_format, binary_magic, binary_version,
+                       transitions.itemsize, table.StateCount(), table.start,
+                       len(accept_table_data)))
+  fh.write(accept_table_data)
+  fh.write(array.array('B', [accept_table.index(accept)
+                             for accept in table.accepts]).tostring())
+  fh.write(array.array('B', map(int, table.wildcards)).tostring())
+  fh.write(transitions.tostring())
+  fh.write(array.array('B', table.byte_classes).tostring())
+  fh.close()
+
+
+# Returns (start, accept_indexes_offset, wildcards_offset,
+# transitions_offset, byte_classes_offset, entry_size, state_count,
+# accept_table).  byte_classes_offset is None for version 1 files,
+# which do not store byte classes.
+def ParseBinaryHeader(data):
+  header_size = struct.calcsize(binary_header_format)
+  (magic, version, entry_size, state_count, start,
+   accept_table_size) = struct.unpack_from(binary_header_format, data, 0)
+  assert magic == binary_magic, 'Not a binary trie file'
+  assert version in (1, binary_version), (
+      'Unknown trie file version: %i' % version)
+  assert entry_size in (1, 2), entry_size
+  offset = header_size
+  # JSON gives us unicode strings, but the rest of the code uses str.
+  accept_table = [str(accept) if isinstance(accept, unicode) else accept
+                  for accept in
+                  json.loads(data[offset:offset + accept_table_size])]
+  accept_indexes_offset = offset + accept_table_size
+  wildcards_offset = accept_indexes_offset + state_count
+  transitions_offset = wildcards_offset + state_count
+  end = transitions_offset + state_count * 256 * entry_size
+  if version >= 2:
+    byte_classes_offset = end
+    end += 256
+  else:
+    byte_classes_offset = None
+  assert end <= len(data), 'Truncated trie file'
+  return (start, accept_indexes_offset, wildcards_offset,
+          transitions_offset, byte_classes_offset, entry_size, state_count,
+          accept_table)
+
+
+def TableFromBinary(data):
+  (start, accept_indexes_offset, wildcards_offset, transitions_offset,
+   byte_classes_offset, entry_size, state_count,
+   accept_table) = ParseBinaryHeader(data)
+  accepts = [accept_table[index] for index in
+             bytearray(data[accept_indexes_offset:wildcards_offset])]
+  wildcards = [flag != 0 for flag in
+               bytearray(data[wildcards_offset:transitions_offset])]
+  transitions = array.array({1: 'B', 2: 'H'}[entry_size])
+  transitions.fromstring(
+      data[transitions_offset:
+           transitions_offset + state_count * 256 * entry_size])
+  if sys.byteorder == 'big':
+    transitions.byteswap()
+  byte_classes = None
+  if byte_classes_offset is not None:
+    byte_classes = list(bytearray(
+        data[byte_classes_offset:byte_classes_offset + 256]))
+  return DfaTable(start, accepts, wildcards, transitions, byte_classes)
+
+
+# A DfaTable whose transition array is read directly from a memory
+# mapping of a binary trie file, rather than being copied.  This makes
+# loading take constant time, and processes that map the same file
+# share the same pages.
+class MappedDfaTable(DfaTable):
+
+  def __init__(self, mapping):
+    (start, accept_indexes_offset, wildcards_offset, transitions_offset,
+     byte_classes_offset, entry_size, state_count,
+     accept_table) = ParseBinaryHeader(mapping)
+    # These are only one byte per state, so copying them is cheap.
+    accepts = [accept_table[ord(index)] for index in
+               mapping[accept_indexes_offset:wildcards_offset]]
+    wildcards = [flag != '\0' for flag in
+                 mapping[wildcards_offset:transitions_offset]]
+    entry_type = {1: ctypes.c_uint8,
+                  2: ctypes.c_uint16.__ctype_le__}[entry_size]
+    transitions = (entry_type * (state_count * 256)).from_buffer(
+        mapping, transitions_offset)
+    byte_classes = None
+    if byte_classes_offset is not None:
+      byte_classes = [ord(byte_class) for byte_class in
+                      mapping[byte_classes_offset:byte_classes_offset + 256]]
+    DfaTable.__init__(self, start, accepts, wildcards, transitions,
+                      byte_classes)
+    self.mapping = mapping
+
+
+def MapTable(filename):
+  fh = open(filename, 'rb')
+  try:
+    # ctypes can only wrap a writable buffer, so we use a private
+    # copy-on-write mapping.  Nothing writes to it, so its pages stay
+    # shared with the page cache.
+    mapping = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY)
+  finally:
+    fh.close()
+  return MappedDfaTable(mapping)
+
+
+def IsBinaryFile(filename):
+  fh = open(filename, 'rb')
+  magic = fh.read(len(binary_magic))
+  fh.close()
+  return magic == binary_magic
+
+
+# Returns a DfaTable for either a binary or a JSON trie file.  If
+# "mapped" is true, binary files are memory-mapped rather than read.
+def LoadTable(filename, mapped=False):
+  if IsBinaryFile(filename):
+    if mapped:
+      return MapTable(filename)
+    fh = open(filename, 'rb')
+    data = fh.read()
+    fh.close()
+    return TableFromBinary(data)
+  return TrieToTable(TrieFromFile(filename))
+
+
 def WriteToFile(output_filename, root):
+  WriteTableFile(output_filename, TrieToTable(root))
+
+
+# JSON files are still useful for tries that have both wildcard and
+# non-wildcard edges on the same node, which the binary format does
+# not support.
+def WriteJsonFile(output_filename, root):
   fh = open(output_filename, 'w')
   json.dump(TrieToDict(root), fh, sort_keys=True)
   fh.close()
 
 
-def TrieFromFile(filename):
+def TrieFromFile(filename, simplify_wildcards=False):
+  if IsBinaryFile(filename):
+    return TableToTrie(LoadTable(filename), simplify_wildcards)
   fh = open(filename, 'r')
   trie_data = json.load(fh)
   fh.close()
-  return TrieFromDict(trie_data)
+  root = TrieFromDict(trie_data)
+  if simplify_wildcards:
+    root = SimplifyWildcards(root)
+  return root
 
 
-def Dump():
-  for i, node in enumerate(node_list):
-    node.id = i
+def Dump(root):
+  node_list = GetAllNodes(root)
+  node_to_id = dict((node, index) for index, node in enumerate(node_list))
   for i, node in enumerate(node_list):
     print 'node %i:' % i
     if node.accept:
       print 'ACCEPT'
     for key, val in sorted(node.children.iteritems()):
-      print '%s -> %s' % (key, val.id)
+      print '%s -> %s' % (key, node_to_id[val])
 
 
 if __name__ == '__main__':
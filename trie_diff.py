@@ -2,52 +2,97 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import optparse
 import sys
 
-from memoize import Memoize
 import trie
+import trie_ops
 
 
-def Diff(node1, node2, context=[]):
-  if node1 == node2:
-    return
-  if node1.accept != node2.accept:
-    print '%r -> %r: %s' % (node1.accept, node2.accept, ' '.join(context))
-  keys = set()
-  keys.update(node1.children.iterkeys())
-  keys.update(node2.children.iterkeys())
-  for key in sorted(keys):
-    Diff(node1.children.get(key, trie.EmptyNode),
-         node2.children.get(key, trie.EmptyNode),
-         context + [key])
-
-
-# Identify wildcard edges, turning implicit (expanded-out) wildcards
-# into explicit 'XX' wildcards.  This is useful when one or both of
-# the diff inputs has had wildcards expanded out.  Explicit wildcards
-# are better when enumerating instructions.
-def SimplifyWildcards(root):
-  @Memoize
-  def Rec(node):
-    dests = set(node.children.itervalues())
-    if len(dests) == 1 and len(set(node.children.iterkeys())) == 256:
-      keys = sorted(node.children.iterkeys())
-      assert keys == ['%02x' % c for c in range(256)], keys
-      children = {'XX': Rec(list(dests)[0])}
+# Returns (root, byte_classes) for a trie file.  JSON files can hold
+# tries that do not fit in a DfaTable, such as ones with both wildcard
+# and byte edges on a node, so they are not converted to one, and each
+# byte gets a class of its own.
+def LoadTrie(filename):
+  if not trie.IsBinaryFile(filename):
+    return (trie.TrieFromFile(filename, simplify_wildcards=True),
+            range(256))
+  table = trie.LoadTable(filename)
+  return trie.TableToTrie(table, simplify_wildcards=True), table.byte_classes
+
+
+# Formats a sorted list of bytes compactly, e.g. '[00-3f,41]'.
+def FormatBytes(bytes):
+  if len(bytes) == 256:
+    return 'XX'
+  if len(bytes) == 1:
+    return '%02x' % bytes[0]
+  ranges = []
+  for byte in bytes:
+    if len(ranges) > 0 and ranges[-1][1] == byte - 1:
+      ranges[-1][1] = byte
+    else:
+      ranges.append([byte, byte])
+  return '[%s]' % ','.join(
+      '%02x' % first if first == last else '%02x-%02x' % (first, last)
+      for first, last in ranges)
+
+
+# Yields (path, accept) for each group of instructions in a trie.
+# Bytes that lead to the same node are reported together, so each
+# element of the path is a byte set as formatted by FormatBytes().
+def SummarizePaths(node, path=[]):
+  if node.accept:
+    yield path, node.accept
+  bytes_by_child = {}
+  children = []
+  for key, child in sorted(node.children.iteritems()):
+    if key == 'XX':
+      bytes = range(256)
     else:
-      children = node.children
-    return trie.MakeInterned(dict((key, Rec(value))
-                                  for key, value in children.iteritems()),
-                             node.accept)
+      bytes = [int(key, 16)]
+    if child not in bytes_by_child:
+      bytes_by_child[child] = []
+      children.append(child)
+    bytes_by_child[child].extend(bytes)
+  for child in children:
+    for result in SummarizePaths(
+        child, path + [FormatBytes(sorted(bytes_by_child[child]))]):
+      yield result
+
 
-  return Rec(root)
+def PrintDifference(title, node, max_paths):
+  templates = trie_ops.Count(node)
+  encodings = trie_ops.Count(node, expand_wildcards=True)
+  print '%s: %i templates, %i encodings' % (title, templates, encodings)
+  count = 0
+  for path, accept in SummarizePaths(node):
+    if count == max_paths:
+      print '  ... (use --max-paths to see more)'
+      break
+    print '  %s: %s' % (' '.join(path), accept)
+    count += 1
 
 
 def Main(args):
-  assert len(args) == 2
-  roots = [SimplifyWildcards(trie.TrieFromFile(filename))
-           for filename in args]
-  Diff(roots[0], roots[1])
+  parser = optparse.OptionParser(usage='%prog [options] trie1 trie2')
+  parser.add_option('--max-paths', dest='max_paths', type='int', default=100,
+                    help='Number of summarized paths to print for each '
+                    'direction (default: %default)')
+  options, args = parser.parse_args(args)
+  assert len(args) == 2, args
+  # The difference is computed on the product of the two automata, so
+  # each pair of nodes is only compared once, and each byte class of
+  # the two DFAs is only followed once.
+  (root1, classes1), (root2, classes2) = [LoadTrie(filename)
+                                          for filename in args]
+  members = trie.ByteClassMembers(trie.RefineByteClasses(classes1, classes2))
+  PrintDifference('Only in %s' % args[0],
+                  trie_ops.Difference(root1, root2, members),
+                  options.max_paths)
+  PrintDifference('Only in %s' % args[1],
+                  trie_ops.Difference(root2, root1, members),
+                  options.max_paths)
 
 
 if __name__ == '__main__':
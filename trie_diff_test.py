@@ -0,0 +1,76 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import trie
+import trie_diff
+import trie_ops
+
+
+class TrieDiffTest(unittest.TestCase):
+
+  def test_difference_by_byte_class(self):
+    normal = trie.MakeInterned({}, 'normal_inst')
+    jump = trie.MakeInterned({}, 'jump_rel1')
+    wildcard = trie.MakeInterned({'XX': normal}, False)
+    partial = trie.MakeInterned(
+        dict((key, normal) for key in trie.byte_keys[:0x40]), False)
+    tables = [
+        trie.TrieToTable(trie.MakeInterned(
+            {'0f': wildcard, '90': normal, 'eb': wildcard}, False)),
+        trie.TrieToTable(trie.MakeInterned(
+            {'0f': partial, '90': jump, 'c3': normal}, False)),
+        ]
+    roots = [trie.TableToTrie(table, simplify_wildcards=True)
+             for table in tables]
+    members = trie.ByteClassMembers(trie.RefineByteClasses(
+        tables[0].byte_classes, tables[1].byte_classes))
+    self.assertTrue(len(members) < 256)
+    for node1, node2 in [roots, reversed(roots)]:
+      self.assertTrue(trie_ops.Difference(node1, node2, members) is
+                      trie_ops.Difference(node1, node2))
+    self.assertTrue(
+        trie_ops.Difference(roots[0], roots[0], members) is trie.EmptyNode)
+
+  def test_json_trie(self):
+    normal = trie.MakeInterned({}, 'normal_inst')
+    jump = trie.MakeInterned({}, 'jump_rel1')
+    # A node with both wildcard and byte edges, which a DfaTable
+    # cannot hold.
+    mixed = trie.MakeInterned({'XX': normal, '05': jump}, False)
+    wildcard = trie.MakeInterned({'XX': normal}, False)
+    temp_dir = tempfile.mkdtemp(prefix='trie_diff_test.')
+    try:
+      json_file = os.path.join(temp_dir, 'mixed.json')
+      binary_file = os.path.join(temp_dir, 'wildcard.trie')
+      trie.WriteJsonFile(json_file, trie.MakeInterned({'0f': mixed}, False))
+      trie.WriteToFile(binary_file, trie.MakeInterned({'0f': wildcard},
+                                                      False))
+      self.assertRaises(AssertionError, trie.LoadTable, json_file)
+      (root1, classes1), (root2, classes2) = [
+          trie_diff.LoadTrie(filename) for filename in (json_file,
+                                                        binary_file)]
+    finally:
+      shutil.rmtree(temp_dir)
+    self.assertEquals(classes1, range(256))
+    members = trie.ByteClassMembers(trie.RefineByteClasses(classes1,
+                                                           classes2))
+    self.assertEquals(
+        list(trie_diff.SummarizePaths(
+            trie_ops.Difference(root1, root2, members))),
+        [(['0f', '05'], 'jump_rel1')])
+    self.assertEquals(
+        list(trie_diff.SummarizePaths(
+            trie_ops.Difference(root2, root1, members))),
+        [(['0f', '05'], 'normal_inst')])
+    self.assertTrue(
+        trie_ops.Difference(root1, root1, members) is trie.EmptyNode)
+
+
+if __name__ == '__main__':
+  unittest.main()
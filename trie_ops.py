@@ -0,0 +1,221 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import optparse
+import sys
+
+from memoize import Memoize
+import trie
+import trie_sample
+
+# Set operations on acyclic DFAs, treating a trie as the set of
+# instructions that it accepts, with their accept types.  trie.Merge()
+# and trie.MergeMany() provide union.
+#
+# The operations walk the product of the two automata, memoized on the
+# pair of nodes, so each pair is visited once however many paths lead
+# to it.  Their results are interned and trimmed: a trie that accepts
+# nothing is EmptyNode.
+#
+# An 'XX' edge stands for every byte that the node has no edge for.
+# Nodes from trie.SimplifyWildcards() or LoadTrie() have either a
+# single 'XX' edge or only byte edges, except that nodes from JSON
+# files can have both.  Results are in the same form, with 256 byte
+# edges to the same node turned into an 'XX' edge.
+
+
+def Child(node, key):
+  child = node.children.get(key)
+  if child is None:
+    child = node.children.get(trie.wildcard_key, trie.EmptyNode)
+  return child
+
+
+# Returns the keys whose children need combining, for an operation
+# whose result has an edge only where both nodes do (if
+# "intersect") or where either node does (if not).
+def ProductKeys(node1, node2, intersect):
+  wild1 = trie.wildcard_key in node1.children
+  wild2 = trie.wildcard_key in node2.children
+  if wild1 and wild2:
+    # A node can also have byte edges besides its 'XX' edge.
+    keys = set(node1.children)
+    keys.update(node2.children)
+    return keys
+  if intersect:
+    if wild1:
+      return node2.children.keys()
+    if wild2:
+      return node1.children.keys()
+    return [key for key in node1.children if key in node2.children]
+  if wild1 or wild2:
+    return trie.byte_keys
+  keys = set(node1.children)
+  keys.update(node2.children)
+  return keys
+
+
+def MakeNode(children, accept):
+  children = dict((key, child) for key, child in children.iteritems()
+                  if child is not trie.EmptyNode)
+  dest = trie.UniformTarget(children)
+  if dest is not None:
+    children = {trie.wildcard_key: dest}
+  return trie.MakeInterned(children, accept)
+
+
+# Returns a trie of the instructions that both tries accept with the
+# same accept type.
+@Memoize
+def Intersection(node1, node2):
+  if node1 is trie.EmptyNode or node2 is trie.EmptyNode:
+    return trie.EmptyNode
+  if node1.accept and node1.accept == node2.accept:
+    accept = node1.accept
+  else:
+    accept = False
+  return MakeNode(dict((key, Intersection(Child(node1, key),
+                                          Child(node2, key)))
+                       for key in ProductKeys(node1, node2, True)),
+                  accept)
+
+
+# Returns a trie of the instructions that node1 accepts and node2 does
+# not accept with the same accept type.
+#
+# If "byte_class_members" is given (see trie.ByteClassMembers()), then
+# where the nodes' edges would be compared one byte at a time, this
+# only follows one byte of each class and gives the other bytes in the
+# class the same child.  That is only correct if the bytes in a class
+# lead to the same children in both tries, as they do for DFA tables
+# whose classes were combined by trie.RefineByteClasses().
+def Difference(node1, node2, byte_class_members=None):
+  @Memoize
+  def Rec(node1, node2):
+    if node1 is node2 or node1 is trie.EmptyNode:
+      return trie.EmptyNode
+    if node1.accept and node1.accept != node2.accept:
+      accept = node1.accept
+    else:
+      accept = False
+    if trie.wildcard_key not in node1.children:
+      # Only node1's edges can lead to anything.
+      keys = node1.children.iterkeys()
+    elif (byte_class_members is not None and
+          trie.wildcard_key not in node2.children):
+      children = {}
+      for members in byte_class_members:
+        key = trie.byte_keys[members[0]]
+        child = Rec(Child(node1, key), Child(node2, key))
+        for byte in members:
+          children[trie.byte_keys[byte]] = child
+      return MakeNode(children, accept)
+    else:
+      keys = ProductKeys(node1, node2, False)
+    return MakeNode(dict((key, Rec(Child(node1, key), Child(node2, key)))
+                         for key in keys),
+                    accept)
+  return Rec(node1, node2)
+
+
+# Returns a trie of the instructions that exactly one of the tries
+# accepts, or that they accept with different accept types.  In the
+# latter case, the result has node1's accept type.
+@Memoize
+def SymmetricDifference(node1, node2):
+  if node1 is node2:
+    return trie.EmptyNode
+  if node1.accept != node2.accept:
+    accept = node1.accept or node2.accept
+  else:
+    accept = False
+  return MakeNode(dict((key, SymmetricDifference(Child(node1, key),
+                                                 Child(node2, key)))
+                       for key in ProductKeys(node1, node2, False)),
+                  accept)
+
+
+# Returns whether the trie accepts nothing.  Unlike the results of the
+# operations above, "node" does not need to be trimmed.
+@Memoize
+def IsEmpty(node):
+  if node.accept:
+    return False
+  for child in node.children.itervalues():
+    if not IsEmpty(child):
+      return False
+  return True
+
+
+# Returns whether every instruction that node1 accepts is accepted by
+# node2 with the same accept type.  This stops at the first
+# counterexample, without building the difference.
+@Memoize
+def IsSubset(node1, node2):
+  if node1 is node2 or node1 is trie.EmptyNode:
+    return True
+  if node1.accept and node1.accept != node2.accept:
+    return False
+  if trie.wildcard_key not in node1.children:
+    keys = node1.children.iterkeys()
+  else:
+    keys = ProductKeys(node1, node2, False)
+  for key in keys:
+    if not IsSubset(Child(node1, key), Child(node2, key)):
+      return False
+  return True
+
+
+def IsEquivalent(node1, node2):
+  return IsSubset(node1, node2) and IsSubset(node2, node1)
+
+
+# Returns the number of instructions that the trie accepts, counting
+# each 'XX' edge as 256 bytes if "expand_wildcards" is true.
+def Count(node, expand_wildcards=False):
+  return trie_sample.InstructionIndex(node, expand_wildcards).Count()
+
+
+def AcceptType(node, bytes):
+  for byte in bytes:
+    node = Child(node, byte)
+  return node.accept
+
+
+def LoadTrie(filename):
+  return trie.TrieFromFile(filename, simplify_wildcards=True)
+
+
+# Checks that trie2 accepts everything that trie1 accepts, e.g. that a
+# new DFA does not accept anything that the old one rejects.  Prints
+# an example if not.
+def Main(args):
+  parser = optparse.OptionParser(usage='%prog [options] trie1 trie2')
+  parser.add_option('--equal', dest='equal', action='store_true',
+                    default=False,
+                    help='Check that the tries accept the same instructions')
+  options, args = parser.parse_args(args)
+  assert len(args) == 2, args
+  node1, node2 = [LoadTrie(filename) for filename in args]
+  if options.equal:
+    checks = [(node1, node2, args[0], args[1]),
+              (node2, node1, args[1], args[0])]
+  else:
+    checks = [(node1, node2, args[0], args[1])]
+  result = 0
+  for sub, super, sub_name, super_name in checks:
+    if IsSubset(sub, super):
+      print '%s accepts everything that %s accepts' % (super_name, sub_name)
+    else:
+      extra = Difference(sub, super)
+      bytes, label_map = trie_sample.InstructionIndex(extra).Unrank(0)
+      print '%s accepts %i templates that %s does not, e.g. %s (%s)' % (
+          sub_name, Count(extra), super_name, ' '.join(bytes),
+          AcceptType(extra, bytes))
+      result = 1
+  return result
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,87 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest
+
+import trie
+import trie_ops
+
+
+def MakePath(bytes, accept):
+  node = trie.MakeInterned({}, accept)
+  for byte in reversed(bytes):
+    node = trie.MakeInterned({byte: node}, False)
+  return node
+
+
+def MergeAcceptTypes(accept_types):
+  accept_types = [accept for accept in accept_types if accept]
+  assert len(accept_types) == 1, accept_types
+  return accept_types[0]
+
+
+def MakeTrie(instrs):
+  return trie.MergeMany([MakePath(bytes, accept) for bytes, accept in instrs],
+                        MergeAcceptTypes)
+
+
+def ListInstrs(node):
+  result = []
+  def Rec(node, path):
+    if node.accept:
+      result.append((path, node.accept))
+    for key, child in sorted(node.children.iteritems()):
+      Rec(child, path + [key])
+  Rec(node, [])
+  return result
+
+
+class TrieOpsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.node1 = MakeTrie([(['90'], 'normal_inst'),
+                           (['c3'], 'normal_inst'),
+                           (['eb', 'XX'], 'jump_rel1')])
+    self.node2 = MakeTrie([(['90'], 'normal_inst'),
+                           (['c3'], 'jump_rel1')]
+                          + [(['eb', key], 'jump_rel1')
+                             for key in trie.byte_keys])
+
+  def test_intersection(self):
+    self.assertEquals(
+        ListInstrs(trie_ops.Intersection(self.node1, self.node2)),
+        [(['90'], 'normal_inst'), (['eb', 'XX'], 'jump_rel1')])
+
+  def test_difference(self):
+    self.assertEquals(ListInstrs(trie_ops.Difference(self.node1, self.node2)),
+                      [(['c3'], 'normal_inst')])
+    self.assertEquals(ListInstrs(trie_ops.Difference(self.node2, self.node1)),
+                      [(['c3'], 'jump_rel1')])
+    self.assertTrue(trie_ops.Difference(self.node1, self.node1)
+                    is trie.EmptyNode)
+
+  def test_symmetric_difference(self):
+    self.assertEquals(
+        ListInstrs(trie_ops.SymmetricDifference(self.node1, self.node2)),
+        [(['c3'], 'normal_inst')])
+
+  def test_subset(self):
+    node = MakeTrie([(['90'], 'normal_inst')])
+    self.assertTrue(trie_ops.IsSubset(node, self.node1))
+    self.assertFalse(trie_ops.IsSubset(self.node1, node))
+    self.assertFalse(trie_ops.IsSubset(self.node1, self.node2))
+    self.assertTrue(trie_ops.IsEquivalent(
+        self.node1, trie.Merge(self.node1, node)))
+    self.assertTrue(trie_ops.IsEmpty(trie.MakeInterned(
+        {'00': trie.EmptyNode}, False)))
+    self.assertFalse(trie_ops.IsEmpty(self.node1))
+
+  def test_count(self):
+    self.assertEquals(trie_ops.Count(self.node1), 3)
+    self.assertEquals(trie_ops.Count(self.node1, expand_wildcards=True),
+                      2 + 256)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,179 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import bisect
+import optparse
+import random
+import sys
+
+import trie
+
+# Counts, ranks and samples the instructions accepted by a trie,
+# without enumerating them.
+#
+# An instruction is the byte path from the root to an accepting node.
+# Instructions are numbered in the order that trie_stages.FlattenTrie()
+# lists them in: a node's own instruction comes before those of its
+# children, and the children are in order of their keys.  Labels
+# (trie_stages.DftLabel nodes) are passed through and collected.
+#
+# If "expand_wildcards" is true, an 'XX' edge stands for each of the
+# 256 byte values, so the instructions are concrete encodings rather
+# than templates, and there can be billions of them.  As in
+# trie_stages.TrieSize(), a node's 'XX' edge is taken to cover its other
+# edges.
+
+
+class InstructionIndex(object):
+
+  def __init__(self, root, expand_wildcards=False):
+    self.root = root
+    self.expand_wildcards = expand_wildcards
+    # Both are filled in lazily, so only the nodes that are looked at
+    # cost anything.
+    self.counts = {}
+    self.edges = {}
+
+  # Returns (keys, children, ends) for "node".  ends[i] is the number of
+  # the first instruction after those under keys[i], counting from the
+  # node's own instruction, if any, as 0.
+  def _Edges(self, node):
+    edges = self.edges.get(node)
+    if edges is None:
+      if self.expand_wildcards and trie.wildcard_key in node.children:
+        keys = [trie.wildcard_key]
+      else:
+        keys = sorted(node.children)
+      children = [node.children[key] for key in keys]
+      ends = []
+      end = int(bool(node.accept))
+      for key, child in zip(keys, children):
+        end += self._Multiplicity(key) * self.Count(child)
+        ends.append(end)
+      edges = (keys, children, ends)
+      self.edges[node] = edges
+    return edges
+
+  def _Multiplicity(self, key):
+    if self.expand_wildcards and key == trie.wildcard_key:
+      return 256
+    return 1
+
+  # Skips over any labels at "node", recording them in "label_map".
+  def _SkipLabels(self, node, label_map):
+    while not isinstance(node, trie.Trie):
+      label_map[node.key] = node.value
+      node = node.next
+    return node
+
+  # Returns the number of instructions under "node", which defaults to
+  # the root.
+  def Count(self, node=None):
+    if node is None:
+      node = self.root
+    count = self.counts.get(node)
+    if count is None:
+      if not isinstance(node, trie.Trie):
+        count = self.Count(node.next)
+      else:
+        keys, children, ends = self._Edges(node)
+        if len(ends) > 0:
+          count = ends[-1]
+        else:
+          count = int(bool(node.accept))
+      self.counts[node] = count
+    return count
+
+  # Returns (bytes, label_map) for instruction number "index".  This
+  # takes time proportional to the length of the instruction.
+  def Unrank(self, index):
+    assert 0 <= index < self.Count(), index
+    bytes = []
+    label_map = {}
+    node = self._SkipLabels(self.root, label_map)
+    while True:
+      if node.accept:
+        if index == 0:
+          return bytes, label_map
+        start = 1
+      else:
+        start = 0
+      keys, children, ends = self._Edges(node)
+      i = bisect.bisect_right(ends, index)
+      if i > 0:
+        start = ends[i - 1]
+      index -= start
+      key = keys[i]
+      if self._Multiplicity(key) > 1:
+        byte, index = divmod(index, self.Count(children[i]))
+        key = trie.byte_keys[byte]
+      bytes.append(key)
+      node = self._SkipLabels(children[i], label_map)
+
+  # Returns the number of the instruction "bytes", which is a list of
+  # keys, as returned by Unrank().
+  def Rank(self, bytes):
+    index = 0
+    node = self._SkipLabels(self.root, {})
+    for byte in bytes:
+      keys, children, ends = self._Edges(node)
+      if keys == [trie.wildcard_key] and self._Multiplicity(keys[0]) > 1:
+        i = 0
+        offset = int(byte, 16) * self.Count(children[0])
+      else:
+        i = bisect.bisect_left(keys, byte)
+        assert i < len(keys) and keys[i] == byte, (
+            'Instruction not in trie: %r' % bytes)
+        offset = 0
+      if i > 0:
+        index += ends[i - 1]
+      elif node.accept:
+        index += 1
+      index += offset
+      node = self._SkipLabels(children[i], {})
+    assert node.accept, 'Instruction not in trie: %r' % bytes
+    return index
+
+  # Returns a uniformly random instruction, as (bytes, label_map).
+  def Sample(self, rng=random):
+    return self.Unrank(rng.randrange(self.Count()))
+
+  # Yields "count" instructions chosen uniformly at random (with
+  # replacement), as (index, bytes, label_map).
+  def Samples(self, count, rng=random):
+    total = self.Count()
+    for unused in xrange(count):
+      index = rng.randrange(total)
+      bytes, label_map = self.Unrank(index)
+      yield index, bytes, label_map
+
+
+def Main(args):
+  parser = optparse.OptionParser()
+  parser.add_option('--trie', dest='trie_file', default='x86_32.trie',
+                    help='Trie file to sample from (default: %default)')
+  parser.add_option('--expand-wildcards', dest='expand_wildcards',
+                    action='store_true', default=False,
+                    help='Sample concrete encodings rather than templates')
+  parser.add_option('-n', dest='count', type='int', default=10,
+                    help='Number of instructions to sample '
+                    '(default: %default)')
+  parser.add_option('--seed', dest='seed', type='int', default=None,
+                    help='Random seed, for reproducible samples')
+  options, args = parser.parse_args(args)
+  assert len(args) == 0, args
+  # The DFA is stored with its wildcards expanded out, so we turn them
+  # back into 'XX' edges to count templates rather than encodings.
+  index = InstructionIndex(trie.TrieFromFile(options.trie_file,
+                                             simplify_wildcards=True),
+                           options.expand_wildcards)
+  print 'Instructions: %i' % index.Count()
+  rng = random.Random(options.seed)
+  for number, bytes, label_map in index.Samples(options.count, rng):
+    print '%i: %s' % (number, ' '.join(bytes))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
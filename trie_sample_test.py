@@ -0,0 +1,42 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import random
+import unittest
+
+import trie
+import trie_sample
+
+
+def MakeTrie():
+  wildcard = trie.MakeInterned({'XX': trie.AcceptNode}, False)
+  prefix = trie.MakeInterned({'00': trie.AcceptNode}, True)
+  return trie.MakeInterned({'0f': wildcard, '90': trie.AcceptNode,
+                            'c3': prefix}, False)
+
+
+class TrieSampleTest(unittest.TestCase):
+
+  def test_templates(self):
+    index = trie_sample.InstructionIndex(MakeTrie())
+    self.assertEquals(index.Count(), 4)
+    instrs = [index.Unrank(i)[0] for i in xrange(index.Count())]
+    self.assertEquals(instrs, [['0f', 'XX'], ['90'], ['c3'], ['c3', '00']])
+    for i, bytes in enumerate(instrs):
+      self.assertEquals(index.Rank(bytes), i)
+
+  def test_expand_wildcards(self):
+    index = trie_sample.InstructionIndex(MakeTrie(), expand_wildcards=True)
+    self.assertEquals(index.Count(), 256 + 3)
+    instrs = [index.Unrank(i)[0] for i in xrange(index.Count())]
+    self.assertEquals(instrs[:256], [['0f', key] for key in trie.byte_keys])
+    self.assertEquals(instrs[256:], [['90'], ['c3'], ['c3', '00']])
+    for i, bytes in enumerate(instrs):
+      self.assertEquals(index.Rank(bytes), i)
+    bytes, label_map = index.Sample(random.Random(1))
+    self.assertTrue(bytes in instrs)
+
+
+if __name__ == '__main__':
+  unittest.main()
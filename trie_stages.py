@@ -0,0 +1,427 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import gc
+import hashlib
+
+import memoize
+from memoize import Memoize
+import trie
+
+# Tries with DftLabel nodes, and the stages of generator.Main() that
+# run after the instruction trie has been built: filtering it for the
+# objdump cross-checks, enumerating its instructions, converting it to
+# a DFA, expanding wildcards and adding the sandboxed jumps.
+#
+# The opcode tables in generator.py change much more often than this
+# code, so generator.py caches these stages under the content of their
+# input trie and the source of this module (and of trie.py and
+# memoize.py, which it uses), not under generator.py.  That way an
+# edit to an opcode table only reruns the stages whose input trie it
+# changes.  Code that a cached stage runs must therefore live here
+# rather than in generator.py.
+
+
+def TrieNode(children, accept=False):
+  node = trie.Trie()
+  node.children = children
+  node.accept = accept
+  return node
+
+
+def TrieOfList(bytes, node):
+  for byte in reversed(bytes):
+    node = TrieNode({trie.CanonicalKey(byte): node})
+  return node
+
+
+class DftLabel(object):
+
+  __slots__ = ('key', 'value', 'next')
+
+  def __init__(self, key, value, next):
+    self.key = key
+    self.value = value
+    self.next = next
+
+def DftLabels(pairs, node):
+  for key, value in pairs:
+    node = DftLabel(key, value, node)
+  return node
+
+
+# Assumes all the input nodes are immutable.
+def MergeMany(nodes, merge_accept_types):
+  if len(nodes) == 1:
+    return list(nodes)[0]
+  if len(nodes) == 0:
+    return trie.EmptyNode
+  children = {}
+  accept_types = set()
+
+  if isinstance(nodes[0], DftLabel):
+    for node in nodes:
+      assert node.key == nodes[0].key, (node.key, nodes[0].key)
+      assert node.value == nodes[0].value, (node.value, nodes[0].value)
+    return DftLabel(nodes[0].key,
+                    nodes[0].value,
+                    MergeMany([node.next for node in nodes],
+                              merge_accept_types))
+
+  by_key = {}
+  for node in nodes:
+    accept_types.add(node.accept)
+    for key, value in node.children.iteritems():
+      by_key.setdefault(key, []).append(value)
+  for key, subnodes in by_key.iteritems():
+    children[key] = MergeMany(subnodes, merge_accept_types)
+
+  if len(accept_types) == 1:
+    accept = list(accept_types)[0]
+  else:
+    accept = merge_accept_types(accept_types)
+  return trie.MakeInterned(children, accept)
+
+
+# Returns a function that gives the number of instructions in any
+# node of a trie.  It caches the counts of the nodes it has seen.
+def TrieSizeCounter(expand_wildcards):
+  @Memoize
+  def Rec(node):
+    if isinstance(node, DftLabel):
+      return Rec(node.next)
+    x = 0
+    if node.accept:
+      x += 1
+    if expand_wildcards and 'XX' in node.children:
+      return x + 256 * Rec(node.children['XX'])
+    else:
+      for child in node.children.itervalues():
+        x += Rec(child)
+      return x
+
+  return Rec
+
+
+def TrieSize(start_node, expand_wildcards):
+  return TrieSizeCounter(expand_wildcards)(start_node)
+
+
+def TrieNodeCount(root):
+  seen = set()
+  def Rec(node):
+    if node not in seen:
+      seen.add(node)
+      if isinstance(node, DftLabel):
+        Rec(node.next)
+      else:
+        for child in node.children.itervalues():
+          Rec(child)
+  Rec(root)
+  return len(seen)
+
+
+def NoMerge(x):
+  raise Exception('Cannot merge %r' % x)
+
+
+# FlattenTrie() lists the instructions in the sub-tries that hold at
+# most this many instructions, and reuses the lists wherever the nodes
+# above them are shared.  It keeps the lists for the children of at
+# most 2 * "suffix_cache_size" nodes at a time.
+suffix_list_limit = 16
+suffix_cache_size = 4096
+
+
+# Returns a list of (bytes, labels) pairs for the instructions in a
+# trie, where "labels" is a tuple of the (key, value) pairs of the
+# DftLabel nodes on the instruction's path.
+def ListSuffixes(node):
+  if isinstance(node, DftLabel):
+    label = ((node.key, node.value),)
+    return [(bytes, label + labels)
+            for bytes, labels in ListSuffixes(node.next)]
+  suffixes = []
+  if node.accept:
+    suffixes.append(([], ()))
+  for byte, child in sorted(node.children.iteritems()):
+    suffixes.extend([([byte] + bytes, labels)
+                     for bytes, labels in ListSuffixes(child)])
+  return suffixes
+
+
+# Yields the instructions in a trie, which may contain DftLabel nodes,
+# in order of their bytes, as (prefix, label_map, suffixes) blocks.
+# Each of "suffixes" is a (bytes, labels) pair, as returned by
+# ListSuffixes(), that gives an instruction when it is appended to
+# "prefix" and "label_map".  These are updated in place as the walk
+# goes on, so the caller must not modify or keep them.
+#
+# Most instructions end in a small sub-trie that is shared by many
+# instructions, such as a ModRM byte followed by its displacement.
+# Only the larger nodes above these are walked, depth-first with an
+# explicit stack that holds the current path.
+def FlattenTrieBlocks(root):
+  Count = TrieSizeCounter(False)
+
+  # Returns the children of a large trie node, in order, as (byte,
+  # node, suffixes) tuples.  For the large children, "suffixes" is
+  # None and the walk descends into "node".
+  @memoize.BoundedMemoize(suffix_cache_size)
+  def Children(node):
+    children = []
+    for byte, child in sorted(node.children.iteritems()):
+      if Count(child) > suffix_list_limit:
+        children.append((byte, child, None))
+      else:
+        children.append((byte, None, ListSuffixes(child)))
+    return children
+
+  if Count(root) <= suffix_list_limit:
+    yield [], {}, ListSuffixes(root)
+    return
+  accept_suffixes = [([], ())]
+  not_found = object()
+  bytes = []
+  label_map = {}
+  # The (key, previous value) of each label on the current path, so
+  # that the label map can be restored when we backtrack.
+  saved_labels = []
+  # For each large trie node on the current path: an iterator over its
+  # remaining children, and the length of saved_labels before the
+  # node's labels were applied.
+  stack = []
+  node = root
+  while True:
+    saved_count = len(saved_labels)
+    while isinstance(node, DftLabel):
+      saved_labels.append((node.key, label_map.get(node.key, not_found)))
+      label_map[node.key] = node.value
+      node = node.next
+    if node.accept:
+      yield bytes, label_map, accept_suffixes
+    stack.append((iter(Children(node)), saved_count))
+
+    # Move on to the next large child, yielding the small children on
+    # the way and backtracking as needed.
+    while len(stack) > 0:
+      children, saved_count = stack[-1]
+      child = next(children, None)
+      if child is not None:
+        byte, node, suffixes = child
+        if suffixes is None:
+          bytes.append(byte)
+          break
+        yield bytes + [byte], label_map, suffixes
+        continue
+      stack.pop()
+      while len(saved_labels) > saved_count:
+        key, value = saved_labels.pop()
+        if value is not_found:
+          del label_map[key]
+        else:
+          label_map[key] = value
+      if len(stack) > 0:
+        bytes.pop()
+    else:
+      return
+
+
+# Yields (bytes, label_map) for each instruction in a trie, which may
+# contain DftLabel nodes, in order of the instructions' bytes.  Each
+# result is the caller's to modify.  To count the instructions without
+# enumerating them, use TrieSize().
+def FlattenTrie(root):
+  for prefix, label_map, suffixes in FlattenTrieBlocks(root):
+    for bytes, labels in suffixes:
+      result = dict(label_map)
+      result.update(labels)
+      yield prefix + bytes, result
+
+
+# Convert from a transducer (with labels) to an acceptor (no labels).
+# Strip all labels, converting relative_jump labels into accept states.
+@Memoize
+def ConvertToDfa(node, accept_type='normal_inst'):
+  if isinstance(node, DftLabel):
+    if node.key == 'relative_jump':
+      assert accept_type == 'normal_inst'
+      accept_type = 'jump_rel%i' % node.value
+    return ConvertToDfa(node.next, accept_type)
+  else:
+    assert node.accept in (True, False)
+    if node.accept:
+      accept = accept_type
+    else:
+      accept = False
+    return trie.MakeInterned(dict((key, ConvertToDfa(value, accept_type))
+                                  for key, value in node.children.iteritems()),
+                             accept)
+
+
+# Expand wildcard bytes.  This has two benefits:
+#  * It allows wildcard edges to be merged with non-wildcards, in
+#    order to support the 'superinst_start' case.
+#  * It allows some nodes to be combined into one (combining explicit
+#    and implicit wildcards).
+@Memoize
+def ExpandWildcards(node):
+  if 'XX' in node.children:
+    assert len(node.children) == 1, node.children.keys()
+    dest = ExpandWildcards(node.children['XX'])
+    children = dict((key, dest) for key in trie.byte_keys)
+  else:
+    children = dict((key, ExpandWildcards(value))
+                    for key, value in node.children.iteritems())
+  return trie.MakeInterned(children, node.accept)
+
+
+@Memoize
+def FilterModRM(node):
+  if isinstance(node, DftLabel):
+    if node.key == 'test_keep' and not node.value:
+      return trie.EmptyNode
+    return DftLabel(node.key, node.value, FilterModRM(node.next))
+  else:
+    children = {}
+    for key, value in node.children.iteritems():
+      value = FilterModRM(value)
+      if value != trie.EmptyNode:
+        children[key] = value
+    return TrieNode(children, node.accept)
+
+
+def FilterPrefix(bytes, node):
+  if len(bytes) == 0:
+    return node
+  elif isinstance(node, DftLabel):
+    return DftLabel(node.key, node.value, FilterPrefix(bytes, node.next))
+  else:
+    return TrieNode({bytes[0]: FilterPrefix(bytes[1:],
+                                            node.children[bytes[0]])},
+                    node.accept)
+
+
+# Flattens a trie, which may contain DftLabel nodes, into a list of
+# tuples that refer to each other by index.  Children come before
+# their parents, so the root is last.
+def TrieToRecords(root):
+  records = []
+  node_to_index = {}
+  def Rec(node):
+    index = node_to_index.get(node)
+    if index is None:
+      if isinstance(node, DftLabel):
+        record = ('label', node.key, node.value, Rec(node.next))
+      else:
+        record = ('node', node.accept,
+                  tuple((key, Rec(child))
+                        for key, child in sorted(node.children.iteritems())))
+      index = len(records)
+      records.append(record)
+      node_to_index[node] = index
+    return index
+  Rec(root)
+  return records
+
+
+# The inverse of TrieToRecords().  Every node is re-interned, since
+# trie.Merge() and the sharing of nodes between stages rely on
+# interned nodes being canonical.
+#
+# Creating this many objects triggers the cyclic garbage collector
+# repeatedly, which scans the whole heap each time.  Tries have no
+# cycles, so we turn it off while loading.
+def TrieFromRecords(records):
+  gc_was_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    nodes = []
+    for record in records:
+      if record[0] == 'label':
+        tag, key, value, next_index = record
+        nodes.append(DftLabel(key, value, nodes[next_index]))
+      else:
+        tag, accept, children = record
+        nodes.append(trie.MakeInterned(
+            dict([(key, nodes[child_index])
+                  for key, child_index in children]),
+            accept))
+    return nodes[-1]
+  finally:
+    if gc_was_enabled:
+      gc.enable()
+
+
+# Returns a hash of the trie's content.  Unlike hashing the output of
+# TrieToRecords(), this does not depend on which identical subtries
+# happen to be shared.
+def TrieDigest(root):
+  @Memoize
+  def Rec(node):
+    if isinstance(node, DftLabel):
+      data = ('label', node.key, node.value, Rec(node.next))
+    else:
+      data = ('node', node.accept,
+              [(key, Rec(child))
+               for key, child in sorted(node.children.iteritems())])
+    return hashlib.sha1(repr(data)).hexdigest()
+  return Rec(root)
+
+
+def InstrFromLabels(label_map):
+  if 'gs_prefix' in label_map:
+    # Modifying the string to add 'gs:' is rather hacky, but it is
+    # probably not worth doing it more cleanly, because NaCl has been
+    # changed so that the %gs segment is only 4 bytes, and the
+    # validator will probably be changed to disallow all but the
+    # simplest %gs usage.
+    if 'rm_arg' in label_map:
+      label_map['rm_arg'] = \
+          label_map['rm_arg'].replace('ds:', 'gs:').replace('[', 'gs:[')
+    elif 'mem_arg' in label_map:
+      label_map['mem_arg'] = label_map['mem_arg'].replace('ds:', 'gs:')
+    else:
+      raise AssertionError('Bad gs prefix usage?')
+  # Each "args" entry is a (do_expand, arg) pair.  If "do_expand" is
+  # true, the argument is given by the "<arg>_arg" label.
+  instr = label_map['instr_name']
+  args = label_map['args']
+  if len(args) != 0:
+    instr += ','.join([' ' + (label_map[arg + '_arg'] if do_expand else arg)
+                       for do_expand, arg in args])
+  if 'lock_prefix' in label_map:
+    instr = 'lock ' + instr
+  return instr
+
+def GetAll(node):
+  for prefix, label_map, suffixes in FlattenTrieBlocks(node):
+    for bytes, labels in suffixes:
+      # InstrFromLabels() may modify the label map it is given.
+      result = dict(label_map)
+      result.update(labels)
+      yield prefix + bytes, InstrFromLabels(result)
+
+
+def SandboxedJumps():
+  tail = trie.MakeInterned({}, 'normal_inst')
+  for reg in range(8):
+    if reg == 4:
+      # The original validator arbitrarily disallows %esp here.
+      continue
+    yield TrieOfList(['%02x' % byte for byte in
+                      [0x83, 0xe0 | reg, 0xe0,  # and $~31, %reg
+                       0xff, 0xe0 | reg]],      # jmp *%reg
+                     tail)
+    yield TrieOfList(['%02x' % byte for byte in
+                      [0x83, 0xe0 | reg, 0xe0,  # and $~31, %reg
+                       0xff, 0xd0 | reg]],      # call *%reg
+                     tail)
+
+
+def MergeAcceptTypes(accept_types):
+  if accept_types == set(['normal_inst', False]):
+    return 'superinst_start'
+  else:
+    raise AssertionError('Cannot merge %r' % accept_types)
@@ -0,0 +1,92 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest
+
+import trie
+import trie_stages
+from trie_stages import DftLabel, TrieNode, TrieOfList
+
+
+# The recursive enumeration that FlattenTrie() replaced, which copies
+# the byte path and label list at every level.
+def SimpleFlattenTrie(node, bytes=[], labels=[]):
+  if isinstance(node, DftLabel):
+    for result in SimpleFlattenTrie(node.next, bytes, labels + [node]):
+      yield result
+  else:
+    if node.accept:
+      yield (bytes, dict((label.key, label.value) for label in labels))
+    for byte, next in sorted(node.children.iteritems()):
+      for result in SimpleFlattenTrie(next, bytes + [byte], labels):
+        yield result
+
+
+def Instr(name, args, node):
+  return DftLabel('instr_name', name, DftLabel('args', args, node))
+
+
+def MakeTrie():
+  accept = trie.AcceptNode
+  # A ModRM-like tail that is shared between several instructions, and
+  # which sets a label that the instructions' args refer to.
+  modrm = TrieNode(dict(
+      ('%02x' % byte,
+       DftLabel('rm_arg', '[reg%i]' % byte,
+                TrieOfList(['XX'] * (byte % 3), accept)))
+      for byte in xrange(8)))
+  reg_rm = [(True, 'rm')]
+  return TrieNode({
+      '01': Instr('add', reg_rm, modrm),
+      '02': Instr('sub', reg_rm, modrm),
+      '0f': TrieNode({
+          '05': Instr('syscall', [], accept),
+          '10': Instr('mov', [(False, 'eax'), (True, 'rm')], modrm),
+          }),
+      '65': DftLabel('gs_prefix', True, TrieNode({
+          '01': Instr('add', reg_rm, modrm),
+          })),
+      # A label that is overridden further down.
+      '90': DftLabel('instr_name', 'xchg', TrieNode(
+          {'90': Instr('nop', [], accept)}, accept=False)),
+      }, accept=False)
+
+
+class TrieStagesTest(unittest.TestCase):
+
+  def test_flatten_trie(self):
+    root = MakeTrie()
+    expected = list(SimpleFlattenTrie(root))
+    self.assertEquals(len(expected), 4 * 8 + 1 + 1)
+    self.assertEquals(trie_stages.TrieSize(root, False), len(expected))
+    # Try listing none, some and all of the sub-tries as suffixes.
+    old_limit = trie_stages.suffix_list_limit
+    try:
+      for limit in (0, 1, 4, 8, 1000):
+        trie_stages.suffix_list_limit = limit
+        self.assertEquals(list(trie_stages.FlattenTrie(root)), expected)
+    finally:
+      trie_stages.suffix_list_limit = old_limit
+
+  def test_results_are_copies(self):
+    root = MakeTrie()
+    results = list(trie_stages.FlattenTrie(root))
+    for bytes, label_map in results:
+      bytes.append('00')
+      label_map['instr_name'] = 'changed'
+    self.assertEquals(list(trie_stages.FlattenTrie(root)),
+                      list(SimpleFlattenTrie(root)))
+
+  def test_get_all(self):
+    instrs = dict((' '.join(bytes), instr)
+                  for bytes, instr in trie_stages.GetAll(MakeTrie()))
+    self.assertEquals(instrs['01 00'], 'add [reg0]')
+    self.assertEquals(instrs['0f 10 02 XX XX'], 'mov eax, [reg2]')
+    self.assertEquals(instrs['0f 05'], 'syscall')
+    self.assertEquals(instrs['65 01 01 XX'], 'add gs:[reg1]')
+    self.assertEquals(instrs['90 90'], 'nop')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,6 +3,8 @@
 # found in the LICENSE file.
 
 import json
+import os
+import tempfile
 import unittest
 
 import trie
@@ -19,6 +21,67 @@ class TrieTest(unittest.TestCase):
     node2 = trie.TrieFromDict(json.loads(json.dumps(trie.TrieToDict(node))))
     self.assertEquals(node, node2)
 
+  def test_binary_save_and_load(self):
+    node = trie.MakeInterned(
+        {'0f': trie.MakeInterned({'XX': trie.AcceptNode}, False),
+         '90': trie.MakeInterned({}, 'normal_inst')}, False)
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+      trie.WriteToFile(filename, node)
+      self.assertTrue(trie.IsBinaryFile(filename))
+      self.assertEquals(trie.TrieFromFile(filename), node)
+      table = trie.LoadTable(filename)
+      state = table.NextState(table.start, 0x0f)
+      self.assertEquals(table.AcceptType(table.NextState(state, 0x12)), True)
+      self.assertEquals(table.NextState(table.start, 0x91), 0)
+      mapped = trie.LoadTable(filename, mapped=True)
+      self.assertEquals(list(mapped.transitions), list(table.transitions))
+      self.assertEquals(mapped.accepts, table.accepts)
+      self.assertEquals(mapped.wildcards, table.wildcards)
+      self.assertEquals(mapped.byte_classes, table.byte_classes)
+      # 0x0f and 0x90 have their own classes.  All other bytes behave
+      # the same in every state.
+      self.assertEquals(table.ClassCount(), 3)
+      self.assertEquals(table.byte_classes[0x12], table.byte_classes[0x00])
+      self.assertEquals(trie.TableToTrie(mapped), node)
+    finally:
+      os.unlink(filename)
+
+  def test_minimize(self):
+    normal = trie.MakeInterned({}, 'normal_inst')
+    wildcard = trie.MakeInterned({'XX': normal}, False)
+    expanded = trie.MakeInterned(
+        dict((key, normal) for key in trie.byte_keys), False)
+    # A subtrie that accepts nothing, but is not EmptyNode.
+    dead = trie.MakeInterned({'00': trie.EmptyNode}, False)
+    root = trie.MakeInterned({'01': wildcard, '02': expanded, '03': dead},
+                             False)
+    minimized, stats = trie.Minimize(root)
+    self.assertEquals(stats['states_before'], 6)
+    self.assertEquals(stats['states_after'], 3)
+    self.assertEquals(stats['dead_states'], 2)
+    self.assertEquals(sorted(minimized.children.keys()), ['01', '02'])
+    self.assertTrue(minimized.children['01'] is minimized.children['02'])
+    # Minimizing again changes nothing.
+    self.assertTrue(trie.Minimize(minimized)[0] is minimized)
+
+  def test_simplify_wildcards(self):
+    normal = trie.MakeInterned({}, 'normal_inst')
+    expanded = trie.MakeInterned(
+        dict((key, normal) for key in trie.byte_keys), False)
+    partial = trie.MakeInterned({'00': normal}, False)
+    root = trie.MakeInterned({'0f': expanded, '90': partial}, False)
+    wildcard = trie.MakeInterned({'XX': normal}, False)
+    simplified = trie.MakeInterned({'0f': wildcard, '90': partial}, False)
+    self.assertTrue(trie.SimplifyWildcards(root) is simplified)
+    # Subtries without expanded wildcards are kept as they are.
+    self.assertTrue(trie.SimplifyWildcards(partial) is partial)
+    table = trie.TrieToTable(root)
+    self.assertTrue(trie.TableToTrie(table) is root)
+    self.assertTrue(
+        trie.TableToTrie(table, simplify_wildcards=True) is simplified)
+
 
 if __name__ == '__main__':
   unittest.main()
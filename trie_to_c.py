@@ -2,6 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import optparse
+import sys
+
 import trie
 
 # Converts the trie/DFA to a C file.
@@ -17,18 +20,34 @@ def SortKey(node):
     return [1]
 
 
-def WriteTransitionTable(out, nodes, node_to_id):
-  out.write('static const uint8_t trie_table[][256] = {\n')
+def GetRows(nodes, node_to_id):
+  rows = []
   for node in nodes:
-    out.write('  /* state %i: accept=%s */ {\n' %
-              (node_to_id[node], node.accept))
     if 'XX' in node.children:
       assert len(node.children) == 1, node.children
-      bytes = [node_to_id[node.children['XX']]] * 256
+      row = [node_to_id[node.children['XX']]] * 256
     else:
-      bytes = [0] * 256
+      row = [0] * 256
       for byte, dest_node in node.children.iteritems():
-        bytes[int(byte, 16)] = node_to_id[dest_node]
+        row[int(byte, 16)] = node_to_id[dest_node]
+    rows.append(row)
+  return rows
+
+
+def WriteArray(out, c_type, name, values, per_line=16):
+  out.write('static const %s %s[%i] = {\n' % (c_type, name, len(values)))
+  for index in xrange(0, len(values), per_line):
+    out.write('  ' + ', '.join('%3i' % value
+                               for value in values[index:index + per_line]))
+    out.write(',\n')
+  out.write('};\n\n')
+
+
+def WriteTransitionTable(out, nodes, node_to_id, rows, byte_class):
+  out.write('static const uint8_t trie_table[][256] = {\n')
+  for node, bytes in zip(nodes, rows):
+    out.write('  /* state %i: accept=%s */ {\n' %
+              (node_to_id[node], node.accept))
     out.write(' ' * 11 + '/* ')
     out.write('  '.join('X%x' % lower for lower in xrange(16)))
     out.write(' */\n')
@@ -44,12 +63,151 @@ static inline uint8_t trie_lookup(uint8_t state, uint8_t byte) {
   return trie_table[state][byte];
 }
 """)
+  return len(rows) * 256
+
+
+# Transitions are looked up via a byte class, using the classes that
+# are stored in the trie file.  This shrinks the table from 256
+# columns to one column per byte class.
+def WriteClassTable(out, nodes, node_to_id, rows, byte_class):
+  class_count = max(byte_class) + 1
+  print 'Using %i byte classes' % class_count
+  WriteArray(out, 'uint8_t', 'trie_byte_class', byte_class)
+  out.write('static const uint8_t trie_table[][%i] = {\n' % class_count)
+  for node, row in zip(nodes, rows):
+    class_row = [0] * class_count
+    for byte in xrange(256):
+      class_row[byte_class[byte]] = row[byte]
+    for byte in xrange(256):
+      assert class_row[byte_class[byte]] == row[byte], 'Bad byte classes'
+    out.write('  /* state %i: accept=%s */ { %s },\n'
+              % (node_to_id[node], node.accept,
+                 ', '.join('%i' % dest for dest in class_row)))
+  out.write('};\n')
+  out.write("""
+static inline uint8_t trie_lookup(uint8_t state, uint8_t byte) {
+  return trie_table[state][trie_byte_class[byte]];
+}
+""")
+  return 256 + len(rows) * class_count
+
+
+# Identical rows are stored once.  The rejecting state's row and the
+# wildcard rows that lead to the same state share storage.
+def WriteDedupTable(out, nodes, node_to_id, rows, byte_class):
+  unique_rows = []
+  row_to_index = {}
+  row_index = []
+  for row in rows:
+    index = row_to_index.setdefault(tuple(row), len(unique_rows))
+    if index == len(unique_rows):
+      unique_rows.append(row)
+    row_index.append(index)
+  print 'Using %i distinct rows for %i states' % (len(unique_rows), len(rows))
+  WriteArray(out, 'uint8_t', 'trie_row_index', row_index)
+  out.write('static const uint8_t trie_rows[][256] = {\n')
+  for row in unique_rows:
+    out.write('  {\n')
+    for upper in xrange(16):
+      out.write('    ' + ', '.join('%2i' % row[upper*16 + lower]
+                                   for lower in xrange(16)))
+      out.write(',\n')
+    out.write('  },\n')
+  out.write('};\n')
+  out.write("""
+static inline uint8_t trie_lookup(uint8_t state, uint8_t byte) {
+  return trie_rows[trie_row_index[state]][byte];
+}
+""")
+  return len(rows) + len(unique_rows) * 256
+
 
+# Row displacement ("comb") compression.  Each state gets a default
+# destination (the most common one in its row, which is its target
+# for wildcard rows) and the remaining entries are packed into shared
+# trie_next/trie_check arrays at an offset of trie_base[state].  An
+# entry belongs to a state only if trie_check holds that state's ID.
+def WriteCombTable(out, nodes, node_to_id, rows, byte_class):
+  state_count = len(rows)
+  # trie_check needs a value that matches no state.
+  unused = state_count
+  assert unused <= 255, 'Too many states for a uint8_t check array'
+  defaults = []
+  entries = []
+  for row in rows:
+    counts = {}
+    for dest in row:
+      counts[dest] = counts.get(dest, 0) + 1
+    default = max(sorted(counts), key=lambda dest: counts[dest])
+    defaults.append(default)
+    entries.append([(byte, dest) for byte, dest in enumerate(row)
+                    if dest != default])
 
-def Main():
+  # trie_lookup() reads trie_check[trie_base[state] + byte], so the
+  # arrays always have at least 256 slots, even if every row is equal
+  # to its default and no entries are packed.
+  next_array = [0] * 256
+  check = [unused] * 256
+  base = [0] * state_count
+  # Place the densest rows first, since they are the hardest to fit.
+  for state in sorted(xrange(state_count),
+                      key=lambda state: (-len(entries[state]), state)):
+    if len(entries[state]) == 0:
+      continue
+    offset = 0
+    while any(offset + byte < len(check) and check[offset + byte] != unused
+              for byte, dest in entries[state]):
+      offset += 1
+    base[state] = offset
+    needed = offset + 256 - len(check)
+    if needed > 0:
+      check.extend([unused] * needed)
+      next_array.extend([0] * needed)
+    for byte, dest in entries[state]:
+      check[offset + byte] = state
+      next_array[offset + byte] = dest
+  print 'Packed %i transitions into %i slots' % (
+      sum(len(row_entries) for row_entries in entries), len(check))
+
+  base_type = 'uint16_t'
+  WriteArray(out, base_type, 'trie_base', base)
+  WriteArray(out, 'uint8_t', 'trie_default', defaults)
+  WriteArray(out, 'uint8_t', 'trie_next', next_array)
+  WriteArray(out, 'uint8_t', 'trie_check', check)
+  out.write("""\
+static inline uint8_t trie_lookup(uint8_t state, uint8_t byte) {
+  unsigned index = trie_base[state] + byte;
+  if (trie_check[index] == state)
+    return trie_next[index];
+  return trie_default[state];
+}
+""")
+  return state_count * 3 + len(check) * 2
+
+
+table_writers = {
+  'full': WriteTransitionTable,
+  'classes': WriteClassTable,
+  'dedup': WriteDedupTable,
+  'comb': WriteCombTable,
+  }
+
+
+def Main(args):
+  parser = optparse.OptionParser()
+  parser.add_option('--mode', dest='mode', default='full',
+                    choices=sorted(table_writers.keys()),
+                    help='How to encode the transition table: %s '
+                    '(default: %%default)' % ', '.join(sorted(table_writers)))
+  options, args = parser.parse_args(args)
+  assert len(args) == 0, args
   trie_file = 'x86_32.trie'
 
-  root_node = trie.TrieFromFile(trie_file)
+  table = trie.LoadTable(trie_file)
+  root_node, stats = trie.Minimize(
+      trie.TableToTrie(table, simplify_wildcards=True))
+  print 'DFA has %(states_after)i states (%(states_before)i before ' \
+      'minimization)' % stats
   nodes = sorted(trie.GetAllNodes(root_node), key=SortKey)
   # Node ID 0 is reserved as the rejecting state.  For a little extra
   # safety, all transitions from node 0 lead to node 0.
@@ -75,16 +233,38 @@ def Main():
                  if node.accept == accept_type]
     print 'Type %r has %i acceptors' % (accept_type, len(acceptors))
     if len(acceptors) > 0:
-      expr = ' || '.join('node_id == %i' % node_id for node_id in acceptors)
+      first = min(acceptors)
+      last = max(acceptors)
+      # SortKey() puts the acceptors of each type next to each other.
+      assert acceptors == range(first, last + 1), (
+          'Type %r has non-contiguous acceptors: %r'
+          % (accept_type, acceptors))
+      if first == last:
+        expr = 'node_id == %i' % first
+      else:
+        # A single unsigned comparison checks both ends of the range.
+        expr = '(unsigned) (node_id - %i) <= %i' % (first, last - first)
     else:
       expr = '0 /* These instructions are currently disallowed */'
     out.write('static inline int trie_accepts_%s(int node_id) '
               '{\n  return %s;\n}\n\n'
               % (accept_type, expr))
 
-  WriteTransitionTable(out, nodes, node_to_id)
+  # Likewise, all the accepting states come straight after state 0, so
+  # the common case of a non-accepting state takes one comparison.
+  accepting = [node_to_id[node] for node in nodes if node.accept != False]
+  assert accepting == range(1, len(accepting) + 1), accepting
+  out.write('static inline int trie_accepts_any(int node_id) '
+            '{\n  return (unsigned) (node_id - 1) < %i;\n}\n\n'
+            % len(accepting))
+
+  assert len(nodes) <= 256, 'Too many states for uint8_t tables'
+  rows = GetRows(nodes, node_to_id)
+  size = table_writers[options.mode](out, nodes, node_to_id, rows,
+                                     table.byte_classes)
+  print 'Transition table (%s): %i bytes' % (options.mode, size)
   out.close()
 
 
 if __name__ == '__main__':
-  Main()
+  Main(sys.argv[1:])
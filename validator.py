@@ -0,0 +1,338 @@
+# Copyright (c) 2012 The Native Client Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import multiprocessing
+import optparse
+import struct
+import sys
+
+import bitmap
+import elf
+import trie
+
+# A Python implementation of the validator in dfa_ncval.c.  This runs
+# the DFA from x86_32.trie directly, so it does not need trie_to_c.py
+# or a C compiler.  It should accept and reject exactly the same code
+# as ValidateChunk() in dfa_ncval.c.
+
+
+bundle_size = 32
+bundle_mask = bundle_size - 1
+
+# Accept types are mapped to small integers so that the inner loop
+# does not need to compare strings.
+ACCEPT_NONE = 0
+ACCEPT_NORMAL = 1
+ACCEPT_JUMP_REL1 = 2
+ACCEPT_JUMP_REL2 = 3
+ACCEPT_JUMP_REL4 = 4
+ACCEPT_SUPERINST_START = 5
+
+accept_codes = {
+  False: ACCEPT_NONE,
+  'normal_inst': ACCEPT_NORMAL,
+  'jump_rel1': ACCEPT_JUMP_REL1,
+  'jump_rel2': ACCEPT_JUMP_REL2,
+  'jump_rel4': ACCEPT_JUMP_REL4,
+  'superinst_start': ACCEPT_SUPERINST_START,
+  }
+
+jump_formats = {
+  ACCEPT_JUMP_REL1: ('<b', 1),
+  ACCEPT_JUMP_REL2: ('<h', 2),
+  ACCEPT_JUMP_REL4: ('<i', 4),
+  }
+
+
+class Dfa(object):
+
+  # "transitions" is a flat sequence indexed by (state << shift) |
+  # column.  The column is the input byte, or the byte's class if
+  # "class_map" is given, in which case "class_map" is a 256-byte
+  # string for bytearray.translate().  State 0 is the rejecting state.
+  def __init__(self, start, transitions, accepts, shift=8, class_map=None):
+    self.start = start
+    self.transitions = transitions
+    self.accepts = accepts
+    self.shift = shift
+    self.class_map = class_map
+
+  # If "use_byte_classes" is true, the table has one column per byte
+  # class rather than per byte.  This uses less memory, at the cost of
+  # translating the input to byte classes first.
+  @classmethod
+  def FromTable(cls, table, use_byte_classes=False):
+    accepts = [accept_codes[accept] for accept in table.accepts]
+    if not use_byte_classes:
+      return cls(table.start, table.transitions, accepts)
+    shift = max(1, (table.ClassCount() - 1).bit_length())
+    transitions = [0] * (table.StateCount() << shift)
+    for state in xrange(table.StateCount()):
+      for byte, byte_class in enumerate(table.byte_classes):
+        transitions[(state << shift) | byte_class] = \
+            table.transitions[state * 256 + byte]
+    return cls(table.start, transitions, accepts, shift,
+               str(bytearray(table.byte_classes)))
+
+
+# Binary trie files are memory-mapped, so that starting a validator
+# process does not depend on the size of the DFA.
+def LoadDfa(filename='x86_32.trie', use_byte_classes=False):
+  return Dfa.FromTable(trie.LoadTable(filename, mapped=True),
+                       use_byte_classes)
+
+
+# Scans the bundles in "chunk", which starts at offset "base" within a
+# code section of "size" bytes.  Bundles always start in the DFA's
+# start state, so the chunks of a section can be scanned independently
+# (see ValidateChunkParallel()) and their results merged.
+#
+# Returns (errors, valid_targets, jump_dests).  valid_targets is a
+# packed bitmap (see bitmap.py) in which bit i is set if an instruction
+# starts at offset base + i; we do not need to record the starts of
+# bundles.  jump_dests lists the section offsets of the direct jumps
+# that need checking against the merged valid_targets.  Jumps are
+# sparse, so a list is cheaper to send back from a worker process than
+# a bitmap of the whole section.
+# Like ValidateChunk() in dfa_ncval.c, this stops at the first rejected
+# instruction, in which case valid_targets is None.
+def ScanBundles(dfa, load_addr, chunk, base, size):
+  data = bytearray(chunk)
+  chunk_size = len(data)
+  assert chunk_size % bundle_size == 0, chunk_size
+  assert base % bundle_size == 0, base
+  transitions = dfa.transitions
+  accepts = dfa.accepts
+  start = dfa.start
+  shift = dfa.shift
+  if dfa.class_map is None:
+    columns = data
+  else:
+    columns = data.translate(dfa.class_map)
+
+  errors = []
+  valid_targets = bitmap.Allocate(chunk_size)
+  jump_dests = []
+
+  offset = 0
+  while offset < chunk_size:
+    # Process an instruction bundle.
+    end = offset + bundle_size
+    pos = offset
+    state = start
+    while pos < end:
+      state = transitions[(state << shift) | columns[pos]]
+      if state == 0:
+        errors.append('rejected at %x (byte 0x%02x)'
+                      % (load_addr + base + pos, data[pos]))
+        return errors, None, jump_dests
+      pos += 1
+      accept = accepts[state]
+      if accept == ACCEPT_NONE:
+        continue
+      if accept == ACCEPT_SUPERINST_START:
+        # We've reached the end of a valid instruction, but it may be
+        # the start of a superinstruction.  Try reading more bytes to
+        # see if we reach an accepting state.  If we don't, we
+        # backtrack.
+        pos2 = pos
+        state2 = state
+        while pos2 < end:
+          state2 = transitions[(state2 << shift) | columns[pos2]]
+          if state2 == 0:
+            break
+          pos2 += 1
+          if accepts[state2] == ACCEPT_NORMAL:
+            # Commit to the superinstruction.
+            pos = pos2
+            break
+      elif accept != ACCEPT_NORMAL:
+        fmt, length = jump_formats[accept]
+        relative = struct.unpack(fmt, str(data[pos - length:pos]))[0]
+        jump_dest = base + pos + relative
+        if (jump_dest & bundle_mask) != 0:
+          if jump_dest < 0 or jump_dest >= size:
+            errors.append('direct jump out of range: %x'
+                          % (jump_dest & 0xffffffff))
+          else:
+            jump_dests.append(jump_dest)
+      if pos < chunk_size:
+        # This is bitmap.SetBit(), inlined.
+        valid_targets[pos >> 3] |= 1 << (pos & 7)
+      state = start
+    offset = end
+    if state != start:
+      errors.append('instruction overlaps bundle boundary at %x'
+                    % (load_addr + base + offset))
+      return errors, None, jump_dests
+  return errors, valid_targets, jump_dests
+
+
+# Unlike dfa_ncval.c, this reports every bad jump target rather than
+# just the first.  The check is done on whole bitmaps at once.
+def CheckJumpTargets(load_addr, valid_targets, jump_dests):
+  jump_targets = bitmap.FromIndexes(len(valid_targets) << 3, jump_dests)
+  bad_targets = bitmap.AndNot(jump_targets, valid_targets)
+  return ['bad jump to %x' % (load_addr + jump_dest)
+          for jump_dest in bitmap.SetBits(bad_targets)]
+
+
+# Merges the results of ScanBundles() for consecutive chunks, in order.
+# This gives the same errors as scanning the whole section at once: the
+# errors of the chunks up to and including the first chunk that was
+# rejected.
+def MergeScans(load_addr, scans):
+  errors = []
+  valid_targets = bytearray()
+  jump_dests = []
+  for chunk_errors, chunk_targets, chunk_jump_dests in scans:
+    errors.extend(chunk_errors)
+    if chunk_targets is None:
+      return errors
+    valid_targets.extend(chunk_targets)
+    jump_dests.extend(chunk_jump_dests)
+  return errors + CheckJumpTargets(load_addr, valid_targets, jump_dests)
+
+
+# Splits a section of "size" bytes into bundle-aligned (begin, end)
+# shards of about "shard_size" bytes.
+def GetShards(size, shard_size):
+  shard_size = max(bundle_size, shard_size & ~bundle_mask)
+  return [(begin, min(begin + shard_size, size))
+          for begin in xrange(0, size, shard_size)]
+
+
+# ScanBundles() copies its input, so ValidateChunk() scans a section
+# this many bytes at a time to avoid holding a second copy of it.
+scan_size = 64 * 1024
+
+
+# Returns a list of error messages, which is empty if the chunk is
+# valid.  Like ValidateChunk() in dfa_ncval.c, this stops at the first
+# rejected instruction but reports every out-of-range jump and every
+# bad jump target.
+def ValidateChunk(dfa, load_addr, data):
+  size = len(data)
+  assert size % bundle_size == 0, size
+  return MergeScans(load_addr,
+                    (ScanBundles(dfa, load_addr, data[begin:end], begin, size)
+                     for begin, end in GetShards(size, scan_size)))
+
+
+# Worker process state for ValidateChunkParallel().  Each worker loads
+# the DFA once, and maps the file being validated rather than having
+# the section contents pickled and sent to it.  Since the parent also
+# maps the file, the workers share its pages.
+#
+# The file is mapped afresh for each shard rather than being kept
+# open between tasks: a later task may name a file that has since been
+# replaced, and scanning a stale mapping of it would accept code that
+# the serial validator rejects.  Mapping a file is cheap next to
+# scanning a shard of it.
+worker_dfa = None
+
+
+def InitWorker(trie_file, use_byte_classes):
+  global worker_dfa
+  worker_dfa = LoadDfa(trie_file, use_byte_classes)
+
+
+def ScanShard((filename, load_addr, section_offset, size, begin, end)):
+  elf_file = elf.ElfFile(filename)
+  try:
+    return ScanBundles(worker_dfa, load_addr,
+                       elf_file.data[section_offset + begin:
+                                     section_offset + end],
+                       begin, size)
+  finally:
+    elf_file.Close()
+
+
+# Validates a section of "filename" using "pool", a multiprocessing
+# pool set up with InitWorker().  The bundles are scanned in shards
+# concurrently, and only the final jump target check is serial.
+def ValidateChunkParallel(pool, filename, load_addr, section_offset, size,
+                          shard_size):
+  assert size % bundle_size == 0, size
+  tasks = [(filename, load_addr, section_offset, size, begin, end)
+           for begin, end in GetShards(size, shard_size)]
+  return MergeScans(load_addr, pool.imap(ScanShard, tasks))
+
+
+def ValidateFile(dfa, filename):
+  elf_file = elf.ElfFile(filename)
+  try:
+    for load_addr, offset, section_data in elf_file.CodeSections():
+      errors = ValidateChunk(dfa, load_addr, section_data)
+      if len(errors) > 0:
+        return errors
+  finally:
+    elf_file.Close()
+  return []
+
+
+# Like ValidateFile(), but sections that are larger than "shard_size"
+# are split into shards that are scanned by the processes in "pool".
+def ValidateFileParallel(dfa, pool, filename, shard_size):
+  elf_file = elf.ElfFile(filename)
+  try:
+    for load_addr, offset, section_data in elf_file.CodeSections():
+      size = len(section_data)
+      if size > shard_size:
+        errors = ValidateChunkParallel(pool, filename, load_addr, offset,
+                                       size, shard_size)
+      else:
+        errors = ValidateChunk(dfa, load_addr, section_data)
+      if len(errors) > 0:
+        return errors
+  finally:
+    elf_file.Close()
+  return []
+
+
+def Main(args):
+  parser = optparse.OptionParser()
+  parser.add_option('--trie', dest='trie_file', default='x86_32.trie',
+                    help='DFA file to validate with (default: %default)')
+  parser.add_option('--byte-classes', dest='use_byte_classes',
+                    action='store_true', default=False,
+                    help='Index the transition table by byte class')
+  parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+                    help='Number of processes to scan large code sections '
+                    'with (default: %default)')
+  parser.add_option('--shard-size', dest='shard_size', type='int',
+                    default=256 * 1024,
+                    help='Size in bytes of the pieces that large code '
+                    'sections are split into when using --jobs '
+                    '(default: %default)')
+  options, args = parser.parse_args(args)
+  dfa = LoadDfa(options.trie_file, options.use_byte_classes)
+  if len(args) == 0:
+    print 'validator.py: no input files'
+  pool = None
+  if options.jobs > 1:
+    pool = multiprocessing.Pool(options.jobs, InitWorker,
+                                (options.trie_file,
+                                 options.use_byte_classes))
+  try:
+    for filename in args:
+      if pool is None:
+        errors = ValidateFile(dfa, filename)
+      else:
+        errors = ValidateFileParallel(dfa, pool, filename,
+                                      options.shard_size)
+      if len(errors) > 0:
+        for error in errors:
+          print error
+        print 'file %r failed validation' % filename
+        return 1
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
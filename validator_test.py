@@ -2,8 +2,12 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import multiprocessing
 import subprocess
 
+from memoize import Memoize
+import validator
+
 
 def WriteFile(filename, data):
   fh = open(filename, "w")
@@ -13,6 +17,17 @@ def WriteFile(filename, data):
     fh.close()
 
 
+@Memoize
+def GetDfa():
+  return validator.LoadDfa()
+
+
+@Memoize
+def GetPool():
+  return multiprocessing.Pool(2, validator.InitWorker,
+                              ('x86_32.trie', False))
+
+
 test_cases = []
 
 def TestCase(asm, accept):
@@ -26,6 +41,14 @@ def TestCase(asm, accept):
       assert rc == 0, rc
     else:
       assert rc == 1, rc
+    # Check that the Python validator agrees with dfa_ncval.
+    errors = validator.ValidateFile(GetDfa(), 'tmp.o')
+    assert (len(errors) == 0) == accept, errors
+    # Check that scanning the code in one-bundle shards in parallel
+    # gives the same errors.
+    sharded_errors = validator.ValidateFileParallel(
+        GetDfa(), GetPool(), 'tmp.o', validator.bundle_size)
+    assert sharded_errors == errors, (sharded_errors, errors)
   test_cases.append(Func)
 
 
@@ -114,6 +137,22 @@ jmp label
 """)
 
 
+def TestRewrittenFile():
+  # The worker processes must not keep validating an old version of a
+  # file after it has been replaced.  The code spans two bundles so
+  # that it is split into shards that are scanned by the pool.
+  print '* test rewritten file'
+  for asm, accept in [('nop', True), ('int $0x80', False)]:
+    full_asm = '.p2align 5, 0x90\n%s\n.p2align 6, 0x90\n' % asm
+    WriteFile('tmp.S', 'nop\n' + full_asm)
+    subprocess.check_call(['gcc', '-m32', '-c', 'tmp.S', '-o', 'tmp.o'])
+    errors = validator.ValidateFileParallel(
+        GetDfa(), GetPool(), 'tmp.o', validator.bundle_size)
+    assert (len(errors) == 0) == accept, errors
+    assert errors == validator.ValidateFile(GetDfa(), 'tmp.o'), errors
+test_cases.append(TestRewrittenFile)
+
+
 def Main():
   for test_case in test_cases:
     test_case()